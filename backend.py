@@ -9,6 +9,29 @@ import json
 import portalocker
 import fitz  # PyMuPDF，用于从 PDF 中提取图像
 import base64
+import zlib
+import atexit
+import threading
+import time
+import glob
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import orjson  # 可选：C 实现的 JSON 编码，比标准库快数倍
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # 可选：非加密哈希，作为查重键比 MD5 快得多
+except ImportError:
+    xxhash = None
+
+try:
+    import msgpack  # 可选：与 zstandard 一起用于力场记录的紧凑二进制存储
+    import zstandard
+except ImportError:
+    msgpack = zstandard = None
 
 # 1. 初始化客户端与配置
 client = OpenAI(
@@ -18,6 +41,111 @@ client = OpenAI(
 
 PROJECT_ROOT = Path(__file__).resolve().parent
 
+# text-embedding-v2 单次请求允许的最大文本条数
+EMBEDDING_BATCH_SIZE = 25
+# 批量入库时超出单次上限的分批请求并发发出，限制同时在途的请求数
+EMBEDDING_MAX_CONCURRENCY = 4
+
+# FAISS 索引：统一使用归一化向量 + 内积（余弦）度量；
+# 规模较小时使用精确暴力检索，超过阈值后切换为 8bit 量化存储的 HNSW 图索引
+HNSW_UPGRADE_THRESHOLD = 4096
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# 整页快照的渲染分辨率（既保存为图片，也发送给 VLM 生成图注）
+FIGURE_RENDER_DPI = 160
+
+# 索引落盘防抖：写入后只标记脏，最多每隔该秒数整体写回一次，进程退出时再补一次
+INDEX_FLUSH_INTERVAL = 30
+# 落盘时只把新增向量写成增量文件（<索引>.delta.<时间戳>）；增量文件超过该数量时合并回主索引文件
+INDEX_DELTA_MERGE_LIMIT = 16
+# 未落盘的新增向量达到该数量时，入库后立即落盘；不足时交给定时器 / 退出时统一落盘
+INDEX_FLUSH_DIRTY_LIMIT = 1000
+
+
+# 入库热路径上的固定 SQL 语句；语句文本保持不变，sqlite3 的语句缓存即可直接复用已编译的语句
+SQL_INSERT_FIGURE = "INSERT INTO figures (paper_id, image_path, caption, page_num) VALUES (?, ?, ?, ?)"
+SQL_INSERT_EMBEDDING = "INSERT OR IGNORE INTO emb_cache (h, vec) VALUES (?, ?)"
+# 论文与力场按多行 VALUES 批量写入，RETURNING 直接取回新行 id，不依赖 rowid 连续递增
+SQL_INSERT_PAPERS = "INSERT INTO papers (title, metadata_json) VALUES {} RETURNING id, title"
+# 力场：OR IGNORE 依靠 formula_hash 的 UNIQUE 约束兜底跳过重复，RETURNING 只返回真正插入的行
+SQL_INSERT_FORCES = ("INSERT OR IGNORE INTO force_fields (formula_hash, force_blob, source_paper) "
+                     "VALUES {} RETURNING id, formula_hash")
+# 单条语句的绑定参数不超过 SQLite 旧版本的 999 上限
+SQL_MAX_VARIABLES = 999
+
+
+def _formula_hash(formula_str):
+    """
+    力场查重键。装有 xxhash 时使用带版本前缀的 xxh3-128（"x3:..."），否则退回 MD5。
+
+    旧库中的键均为无前缀的 MD5，查重时需同时比对 _legacy_formula_hash。
+    """
+    if xxhash is not None:
+        return "x3:" + xxhash.xxh3_128_hexdigest(formula_str)
+    return _legacy_formula_hash(formula_str)
+
+
+def _legacy_formula_hash(formula_str):
+    return hashlib.md5(formula_str.encode()).hexdigest()
+
+
+def _json_dumps(obj):
+    """序列化入库用的 JSON 字符串；装有 orjson 时优先使用"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def connect_db(db_path, **kwargs):
+    """
+    打开 SQLite 连接并统一应用 PRAGMA 调优；所有读写该知识库的地方都应通过这里建连。
+
+    WAL 让读者与写者互不阻塞，synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync。
+    """
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-65536;")  # 64MB 页缓存
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")  # 256MB 内存映射读
+    conn.execute("PRAGMA busy_timeout=10000;")  # 其他进程持有写锁时排队等待而不是立即报错
+    return conn
+
+
+def _pack_record(obj):
+    """
+    把力场记录压缩为 BLOB：首字节标记编码格式，便于读取时分派。
+
+    b"Z" = zstd(msgpack)，需要可选依赖；否则 b"J" = zlib(JSON)，只依赖标准库。
+    """
+    if zstandard is not None:
+        return b"Z" + zstandard.ZstdCompressor(level=3).compress(msgpack.packb(obj))
+    return b"J" + zlib.compress(_json_dumps(obj).encode(), 6)
+
+
+def _unpack_record(blob):
+    """_pack_record 的逆过程"""
+    tag, payload = blob[:1], blob[1:]
+    if tag == b"Z":
+        if zstandard is None:
+            raise RuntimeError("该记录以 zstd+msgpack 存储，请安装 zstandard 与 msgpack")
+        return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(payload))
+    return json.loads(zlib.decompress(payload))
+
+
+def _render_page(pdf_path, page_index, dpi, out_path):
+    """
+    将 PDF 的单页渲染为 PNG（供进程池调用）。
+
+    fitz.Document 无法跨进程传递，因此在 worker 内部重新打开文件。
+    """
+    with fitz.open(pdf_path) as doc:
+        pix = doc[page_index].get_pixmap(dpi=dpi)
+        pix.save(out_path)
+    return out_path
+
 
 class ComplexPlasmaRAG:
     def __init__(self, db_path="plasma_knowledge.db",
@@ -37,63 +165,294 @@ class ComplexPlasmaRAG:
         self.dimension = 1536
 
         # 1. 初始化 SQLite 数据库 (用于元数据持久化和查重)
+        # 整个实例复用长连接，避免每次查询都重新建连、重放 PRAGMA 并冷启动页缓存：
+        # _conn 只用于写入（_db_lock 保护），_read_conn 只用于检索路径的读取（_read_lock 保护，只在单条查询期间持有）。
+        # WAL 下读连接不受写事务阻塞，检索不会等待入库。
+        self._db_lock = threading.RLock()
+        self._read_lock = threading.Lock()
+        # 写者串行：入库事务、索引副本构建与切换、索引落盘彼此互斥；检索路径从不获取该锁
+        self._write_lock = threading.RLock()
+        # 写入在索引副本上进行（见 _build_shadow），_index_lock 只保护索引引用的读取与切换。
+        # 检索路径不经过任何文件锁，也不等待入库事务。
+        self._index_lock = threading.RLock()
+        self._conn = self._open_connection()
+        self._read_conn = self._open_connection()
+        # 检索时新算出的查询向量交给单独的线程写入 emb_cache，检索本身不等待写锁
+        self._cache_writer = ThreadPoolExecutor(max_workers=1)
+        # 索引落盘状态（键为 "paper" / "force"）：
+        # _pending 为尚未写盘的新增向量批次；_full_save 表示索引结构已重建，需整体重写主文件
+        self._pending = {"paper": [], "force": []}
+        self._full_save = {"paper": False, "force": False}
+        self._dirty_adds = 0  # 自上次落盘以来新增的向量数
+        self._flush_timer = None
+        atexit.register(self.close)
         self._init_sqlite()
 
         # 2. 初始化或加载 FAISS 索引
-        if os.path.exists(self.paper_idx_path):
-            index = faiss.read_index(self.paper_idx_path)
-            if not isinstance(index, faiss.IndexIDMap):
-                print("⚠️ 索引不是 IDMap，自动包装...")
-                index = faiss.IndexIDMap(index)
-            self.paper_index = index
-
-            # self.paper_index = faiss.read_index(self.paper_idx_path)
-            print(f"从磁盘加载论文索引，当前规模: {self.paper_index.ntotal}")
-        else:
-            # self.paper_index = faiss.IndexFlatL2(self.dimension)
-            base_index = faiss.IndexFlatL2(self.dimension)
-            self.paper_index = faiss.IndexIDMap(base_index)
-
-        if os.path.exists(self.force_idx_path):
-            index = faiss.read_index(self.force_idx_path)
-            if not isinstance(index, faiss.IndexIDMap):
-                print("⚠️ 索引不是 IDMap，自动包装...")
-                index = faiss.IndexIDMap(index)
-            self.force_index = index
-
-            # self.force_index = faiss.read_index(self.force_idx_path)
-            print(f"从磁盘加载力场索引，当前规模: {self.force_index.ntotal}")
+        # SQLite 是唯一可信来源，索引文件只是可重建的缓存：文件丢失或落盘前崩溃时按库中记录补齐
+        self.paper_index = self._rebuild_from_db(
+            "paper", self._load_index(self.paper_idx_path, "论文"), self.paper_idx_path, "论文")
+        self.force_index = self._rebuild_from_db(
+            "force", self._load_index(self.force_idx_path, "力场"), self.force_idx_path, "力场")
+
+    def _load_index(self, path, label):
+        """加载主索引文件并合并遗留的增量文件；存在增量时合并后重写主文件并删除增量"""
+        index = self._load_base_index(path, label)
+        deltas = self._delta_paths(path)
+        if not deltas:
+            return index
+
+        print(f"合并{label}索引的 {len(deltas)} 个增量文件...")
+        for delta_path in deltas:
+            vectors, ids = self._extract_vectors(faiss.read_index(delta_path))
+            index.add_with_ids(vectors, ids)
+        index = self._maybe_upgrade_index(index)
+        self._safe_save_index(index, path)
+        for delta_path in deltas:
+            os.remove(delta_path)
+        return index
+
+    def _rebuild_from_db(self, kind, index, path, label):
+        """
+        把 SQLite 中主键大于索引内最大 id 的记录（索引文件丢失，或提交后未及落盘）重新向量化并写回索引文件。
+
+        主键按写入顺序递增，只需一次范围查询；重建使用与入库时相同的文本，
+        向量大多命中 emb_cache，不会重新请求 embedding 接口。
+        """
+        max_id = int(faiss.rev_swig_ptr(index.id_map.data(), index.id_map.size()).max()) if index.ntotal else 0
+        if kind == "paper":
+            rows = self._conn.execute("SELECT id, metadata_json FROM papers WHERE id > ? ORDER BY id",
+                                      (max_id,)).fetchall()
         else:
-            # self.force_index = faiss.IndexFlatL2(self.dimension)
-            base_index = faiss.IndexFlatL2(self.dimension)
-            self.force_index = faiss.IndexIDMap(base_index)
+            rows = self._conn.execute("SELECT id, force_blob, force_json FROM force_fields WHERE id > ? ORDER BY id",
+                                      (max_id,)).fetchall()
+        if not rows:
+            return index
+
+        print(f"⚠️ {label}索引缺少数据库中的 {len(rows)} 条记录，按库重建...")
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        texts = []
+        for row in rows:
+            if kind == "paper":
+                data = json.loads(row[1])
+                background = (data.get('physics_context') or {}).get('detailed_background', 'No background available')
+                texts.append(f"Title: {data['metadata']['title']}. Context: {background}")
+            else:
+                ff = _unpack_record(row[1]) if row[1] is not None else json.loads(row[2])
+                texts.append(f"Interparticle Interaction: {ff['name']}. Significance: {ff['physical_significance']}")
+        index.add_with_ids(self.get_embeddings_batch(texts), ids)
+        index = self._maybe_upgrade_index(index)
+        self._safe_save_index(index, path)
+        return index
+
+    @staticmethod
+    def _delta_paths(path):
+        """按写入时间顺序列出某索引的增量文件（纳秒时间戳位数相同，字典序即时间序）"""
+        return sorted(p for p in glob.glob(glob.escape(path) + ".delta.*") if not p.endswith(".tmp"))
+
+    def _load_base_index(self, path, label):
+        """从磁盘加载 FAISS 索引；文件不存在时新建一个小规模的暴力检索索引"""
+        if not os.path.exists(path):
+            return self._new_flat_index()
+
+        index = faiss.read_index(path)
+        if not isinstance(index, faiss.IndexIDMap):
+            print("⚠️ 索引不是 IDMap，自动包装...")
+            index = faiss.IndexIDMap(index)
+        inner = faiss.downcast_index(index.index)
+        print(f"从磁盘加载{label}索引，当前规模: {index.ntotal}")
+
+        is_l2 = inner.metric_type != faiss.METRIC_INNER_PRODUCT
+        if is_l2 or isinstance(inner, faiss.IndexFlat):
+            # 旧版索引为 float32 暴力索引（更早的版本还是 L2 距离）：取回全部向量，
+            # 必要时归一化，重建为 fp16 存储的内积索引，并立即写回磁盘
+            if is_l2:
+                print(f"⚠️ {label}索引为 L2 度量，迁移为归一化内积（余弦）索引...")
+            else:
+                print(f"⚠️ {label}索引为 float32 存储，迁移为 fp16 标量量化存储...")
+            vectors, ids = self._extract_vectors(index)
+            if is_l2:
+                faiss.normalize_L2(vectors)
+            index = self._new_flat_index()
+            index.add_with_ids(vectors, ids)
+            index = self._maybe_upgrade_index(index)
+            self._safe_save_index(index, path)
+            return index
+
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = HNSW_EF_SEARCH
+        return self._maybe_upgrade_index(index)
+
+    def _new_flat_index(self):
+        """
+        小规模时使用暴力检索，外层用 IDMap2 以便按 SQLite 主键写入并回读向量。
+
+        向量以 fp16 标量量化存储（每个向量 6KB -> 3KB），内存带宽与落盘体积减半，
+        对归一化后的 embedding 精度损失可以忽略；fp16 无需训练。
+        向量入库与检索前都会做 L2 归一化，内积即余弦相似度。
+        """
+        return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_fp16,
+                                                            faiss.METRIC_INNER_PRODUCT))
+
+    @staticmethod
+    def _extract_vectors(index):
+        """按存储顺序取回 IDMap 索引中的全部向量（解码为 float32）及其外部 id"""
+        inner = faiss.downcast_index(index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        ids = faiss.vector_to_array(index.id_map).astype('int64')
+        return np.ascontiguousarray(vectors, dtype='float32'), ids
+
+    def _maybe_upgrade_index(self, index):
+        """
+        规模超过 HNSW_UPGRADE_THRESHOLD 后，把暴力检索索引一次性重建为 HNSW 图索引。
+
+        暴力检索是 O(N·d) 的顺序扫描；HNSW 为亚线性图遍历，召回略有损失。
+        重建时向量改用 8bit 标量量化存储（每个向量 3KB -> 1.5KB），
+        量化器直接用暴力索引阶段积累的全部向量训练。
+        """
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW) or index.ntotal < HNSW_UPGRADE_THRESHOLD:
+            return index
+
+        print(f"索引规模达到 {index.ntotal}，重建为 HNSW + SQ8 索引...")
+        vectors, ids = self._extract_vectors(index)
+
+        hnsw = faiss.IndexHNSWSQ(self.dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M,
+                                 faiss.METRIC_INNER_PRODUCT)
+        hnsw.train(vectors)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        upgraded = faiss.IndexIDMap2(hnsw)
+        upgraded.add_with_ids(vectors, ids)
+        return upgraded
+
+    def _open_connection(self):
+        """打开长连接：isolation_level=None 由调用方显式管理事务，PRAGMA 只在建连时设置一次"""
+        # IN (...) 查询会随参数个数生成不同的语句文本，放大语句缓存（默认 128）避免热语句被挤出
+        return connect_db(self.db_path, check_same_thread=False, isolation_level=None, cached_statements=512)
+
+    def _schedule_flush(self):
+        """索引已被修改：若尚无待执行的定时器，则在 INDEX_FLUSH_INTERVAL 秒后统一落盘"""
+        with self._write_lock:
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(INDEX_FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _build_shadow(self, kind, vectors, ids):
+        """
+        双缓冲：在当前 paper / force 索引的副本上追加向量（必要时重建为 HNSW），返回新索引。
+
+        已发布的索引从不被原地修改，检索线程无需等待写入；调用方需持有 _write_lock，保证写者串行。
+        """
+        shadow = faiss.clone_index(getattr(self, f"{kind}_index"))
+        shadow.add_with_ids(vectors, ids)
+        upgraded = self._maybe_upgrade_index(shadow)
+        return upgraded, upgraded is not shadow
+
+    def _publish_index(self, kind, index, rebuilt, vectors, ids):
+        """切换为新索引（只在赋值时短暂持有 _index_lock）并记录待落盘的增量；调用方需持有 _write_lock"""
+        with self._index_lock:
+            setattr(self, f"{kind}_index", index)
+        self._dirty_adds += len(ids)
+        if rebuilt:
+            # 已重建为 HNSW，增量文件无法表达，改为整体重写
+            self._full_save[kind] = True
+            self._pending[kind].clear()
+        elif not self._full_save[kind]:
+            self._pending[kind].append((vectors, ids))
+
+    def flush(self):
+        """
+        把未落盘的新增向量写回磁盘（批量导入结束后也可手动调用）。
+
+        通常只写一个仅含新增向量的增量文件，I/O 与新增量成正比而非与索引总规模成正比；
+        索引重建过或增量文件积累过多时，才整体重写主索引文件并清理增量。
+        """
+        # 持有 _write_lock 即与写者互斥；已发布的索引不会被原地修改，写盘期间检索照常进行
+        with self._write_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            for kind, path in (("paper", self.paper_idx_path), ("force", self.force_idx_path)):
+                pending = self._pending[kind]
+                deltas = self._delta_paths(path)
+                if self._full_save[kind] or (pending and len(deltas) >= INDEX_DELTA_MERGE_LIMIT):
+                    self._safe_save_index(getattr(self, f"{kind}_index"), path)
+                    for delta_path in deltas:
+                        os.remove(delta_path)
+                elif pending:
+                    delta = self._new_flat_index()
+                    delta.add_with_ids(np.concatenate([v for v, _ in pending]),
+                                       np.concatenate([i for _, i in pending]))
+                    self._safe_save_index(delta, f"{path}.delta.{time.time_ns()}", lock=False)
+                pending.clear()
+                self._full_save[kind] = False
+            self._dirty_adds = 0
+
+    def close(self):
+        """落盘未保存的索引并关闭长连接；关闭前执行 PRAGMA optimize 让 SQLite 更新索引统计信息"""
+        # 先等待排队中的 emb_cache 写入完成，再按 写者锁 -> 连接锁 的顺序加锁（与入库路径一致，避免死锁）
+        self._cache_writer.shutdown(wait=True)
+        with self._write_lock, self._db_lock:
+            self.flush()
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute("PRAGMA optimize;")
+            finally:
+                self._conn.close()
+                self._conn = None
+                with self._read_lock:
+                    self._read_conn.close()
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        """
+        在共享连接上开启显式事务：正常退出时 COMMIT，异常时 ROLLBACK
+
+        immediate=True 时使用 BEGIN IMMEDIATE，开事务即取得写锁：
+        先读后写的入库事务不会在中途升级写锁时因其他写者而 SQLITE_BUSY。
+        """
+        with self._db_lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
 
     def _init_sqlite(self):
         """初始化数据库表结构"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")
-            conn.execute("PRAGMA synchronous=NORMAL;")
-
-            cursor = conn.cursor()
-            # 论文表：以标题作为唯一约束进行查重
+        with self._transaction() as cursor:
+            # 论文表：以标题作为唯一约束进行查重；FAISS 外部向量 id 即主键 id（vector_id 仅为兼容旧数据保留）
+            # 主键不再使用 AUTOINCREMENT（省去 sqlite_sequence 维护）；表中从不删除行，新 id 不会与已有向量 id 冲突
             cursor.execute('''CREATE TABLE IF NOT EXISTS papers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 title TEXT UNIQUE,
                 metadata_json TEXT,
                 vector_id INTEGER
             )''')
-            # 力场表：以公式和背景的组合哈希作为唯一约束
+            # 力场表：以公式和背景的组合哈希作为唯一约束；FAISS 外部向量 id 即主键 id（vector_id 仅为兼容旧数据保留）
             cursor.execute('''CREATE TABLE IF NOT EXISTS force_fields (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 formula_hash TEXT UNIQUE,
                 force_json TEXT,
                 source_paper TEXT,
-                vector_id INTEGER
+                vector_id INTEGER,
+                force_blob BLOB
             )''')
+            # 旧库补充 force_blob 列：新记录压缩存入 force_blob（见 _pack_record），旧记录仍保留在 force_json
+            force_columns = {row[1] for row in cursor.execute("PRAGMA table_info(force_fields)")}
+            if "force_blob" not in force_columns:
+                cursor.execute("ALTER TABLE force_fields ADD COLUMN force_blob BLOB")
             # 3. 新增：图表信息表
             # 存储每张图片的路径、标注、所属页码，以及预留的向量 ID
             cursor.execute('''CREATE TABLE IF NOT EXISTS figures (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            id INTEGER PRIMARY KEY,
                             paper_id INTEGER,
                             image_path TEXT,
                             caption TEXT,
@@ -101,7 +460,21 @@ class ComplexPlasmaRAG:
                             figure_vector_id INTEGER,
                             FOREIGN KEY (paper_id) REFERENCES papers (id)
                         )''')
-            conn.commit()
+            # 检索已改为按主键 id 取行，旧版本在 vector_id 上建的索引不再使用，只会拖慢每次插入
+            cursor.execute("DROP INDEX IF EXISTS idx_papers_vec")
+            cursor.execute("DROP INDEX IF EXISTS idx_forces_vec")
+            # 图表按所属论文查询 / 关联
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_figures_paper ON figures(paper_id)")
+            # 向量缓存表：按文本内容哈希保存已归一化的 float32 向量，重复文本不再请求 Embedding API
+            cursor.execute('''CREATE TABLE IF NOT EXISTS emb_cache (
+                h TEXT PRIMARY KEY,
+                vec BLOB
+            )''')
+            # 解析结果缓存表：按 PDF 文件 SHA-256 保存最终结构化结果，同一文件重复上传时跳过 LLM 流水线
+            cursor.execute('''CREATE TABLE IF NOT EXISTS paper_cache (
+                file_hash TEXT PRIMARY KEY,
+                structured_json TEXT
+            )''')
 
     def extract_figures(self, file_path: str, structured_text: dict):
         """
@@ -109,7 +482,7 @@ class ComplexPlasmaRAG:
 
         当前版本（Step 2 & 3 原型）：
         - 仍按“整页截图”方式为每一页生成一张 PNG（后续可升级为精确图表裁剪）。
-        - 对每一页图像，结合 structured_text['parameters']，调用视觉大模型（预留接口）推断：
+        - 所有页面先在进程池中并行渲染完毕，再并发地对每一页图像结合 structured_text['parameters'] 调用视觉大模型推断：
           * 该图的物理含义 caption（侧重描述与模拟参数的关系）；
           * 与之最相关的物理参数列表 linked_parameters。
         - 返回的数据结构与 JSON 中 figures 字段保持一致，便于前端和数据库直接使用。
@@ -137,19 +510,34 @@ class ComplexPlasmaRAG:
             base_dir.mkdir(parents=True, exist_ok=True)
             print(f"[extract_figures] pdf_path={pdf_path}, base_dir={base_dir}")
 
-            doc = fitz.open(str(pdf_path))
+            with fitz.open(str(pdf_path)) as doc:
+                page_count = len(doc)
             max_pages_for_figures = 6  # 限制处理页数，避免过多调用 VLM
-
-            for page_index in range(len(doc)):
-                if page_index >= max_pages_for_figures:
-                    break
-                page = doc[page_index]
-                # 先使用整页截图作为粗粒度图表（后续可演进为图表区域裁剪）
-                pix = page.get_pixmap(dpi=160)
-                img_name = f"{pdf_path.stem}_p{page_index + 1}.png"
-                img_path = base_dir / img_name
-                pix.save(str(img_path))
-
+            page_indices = list(range(min(page_count, max_pages_for_figures)))
+            img_paths = [base_dir / f"{pdf_path.stem}_p{i + 1}.png" for i in page_indices]
+
+            # 阶段 A：先把所有页面渲染成 PNG（CPU 密集），按页分发到进程池并行渲染，
+            # 避免 PyMuPDF 渲染与后续网络请求交错执行
+            workers = min(os.cpu_count() or 1, len(page_indices))
+            rendered_in_pool = False
+            if workers > 1:
+                try:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        list(pool.map(_render_page,
+                                      [str(pdf_path)] * len(page_indices),
+                                      page_indices,
+                                      [FIGURE_RENDER_DPI] * len(page_indices),
+                                      [str(p) for p in img_paths]))
+                    rendered_in_pool = True
+                except Exception as e:
+                    # 进程池不可用（受限环境等）时退回串行渲染
+                    print(f"⚠️ [extract_figures] 进程池渲染失败，改为串行: {repr(e)}")
+            if not rendered_in_pool:
+                for page_index, img_path in zip(page_indices, img_paths):
+                    _render_page(str(pdf_path), page_index, FIGURE_RENDER_DPI, str(img_path))
+
+            rendered_pages = []
+            for page_index, img_path in zip(page_indices, img_paths):
                 abs_img_path = img_path.resolve()
                 try:
                     # 对数据库与前端都存储为【相对项目根目录】的路径
@@ -161,21 +549,28 @@ class ComplexPlasmaRAG:
                     print(f"[extract_figures] WARNING: image not under PROJECT_ROOT, stored abs path: {image_path_str}")
 
                 print(f"[extract_figures] page={page_index + 1}, img_abs={abs_img_path}, stored_rel={image_path_str}")
+                rendered_pages.append((page_index + 1, abs_img_path, image_path_str))
 
-                # 阶段 B&C：调用视觉模型做物理语义对标（带强兜底）
-                caption, linked_params = self._annotate_figure_with_vlm(
-                    abs_img_path, page_index + 1, param_summary_text
-                )
+            if not rendered_pages:
+                return figures
 
+            # 阶段 B&C：并发调用视觉模型做物理语义对标（带强兜底）
+            # 每页一次 VLM 请求是纯 I/O 等待，用线程池并发发出，总耗时约为最慢的一次往返
+            with ThreadPoolExecutor(max_workers=len(rendered_pages)) as pool:
+                annotations = list(pool.map(
+                    lambda item: self._annotate_figure_with_vlm(item[1], item[0], param_summary_text),
+                    rendered_pages,
+                ))
+
+            for (page_num, _, image_path_str), (caption, linked_params) in zip(rendered_pages, annotations):
                 figures.append({
-                    "id": f"page-{page_index + 1}",
+                    "id": f"page-{page_num}",
                     "caption": caption,
-                    "page": page_index + 1,
+                    "page": page_num,
                     "linked_parameters": linked_params,
                     "image_path": image_path_str
                 })
 
-            doc.close()
         except Exception as e:
             print(f"⚠️ extract_figures 发生异常: {e}")
 
@@ -290,12 +685,38 @@ class ComplexPlasmaRAG:
             print(f"⚠️ [VLM] annotate 发生异常(page={page_index}): {repr(e)}")
             return fallback
 
+    @staticmethod
+    def _file_sha256(file_path, chunk_size=1 << 20):
+        """
+        流式计算文件 SHA-256，避免把大体积 PDF 整个读入内存。
+
+        Python 3.11+ 使用 hashlib.file_digest（由 OpenSSL 计算，可用 SHA-NI 指令加速），
+        旧版本退回 1MB 分块 update。
+        """
+        with open(file_path, 'rb') as f:
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "sha256").hexdigest()
+            h = hashlib.sha256()
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
     def extract_paper_structure(self, file_path):
         """
         第一步：双模型流水线提取
         Stage 1: qwen-long 负责深度物理理解 (文本输出)
         Stage 2: qwen-turbo 负责严格 JSON 格式化
+
+        解析成功的结果按文件 SHA-256 缓存在 paper_cache 表中，同一文件再次解析时直接返回。
         """
+        file_hash = self._file_sha256(file_path)
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT structured_json FROM paper_cache WHERE file_hash = ?",
+                                          (file_hash,)).fetchone()
+        if row:
+            print(f"♻️ 命中解析缓存，跳过 LLM 流水线: {file_path}")
+            return json.loads(row[0])
+
         print(f"🚀 [阶段 1] 正在调用 qwen-long 进行深度物理提取: {file_path}")
         try:
             file_object = client.files.create(file=Path(file_path), purpose="file-extract")
@@ -470,6 +891,9 @@ class ComplexPlasmaRAG:
                 print(f"⚠️ 提取图像失败: {e}")
 
             print(final_data)
+            with self._db_lock:
+                self._conn.execute("INSERT OR REPLACE INTO paper_cache (file_hash, structured_json) VALUES (?, ?)",
+                                   (file_hash, _json_dumps(final_data)))
             return final_data
 
         except json.JSONDecodeError as e:
@@ -481,35 +905,89 @@ class ComplexPlasmaRAG:
                 default_structure["metadata"]["title"] = title_match.group(1).strip()
             return default_structure
 
-    def search_knowledge(self, query_text, top_k=2):
-        """基于向量检索结果，从 SQLite 硬盘数据库回捞详尽元数据"""
-        query_vector = self.get_embedding(query_text)
+    @staticmethod
+    def _search_subset(index, query_vector, candidate_ids, top_k):
+        """
+        只在给定的候选 id 子集内做精确内积打分（元数据预筛选之后的重排）。
+
+        按 id 从索引中批量取回向量，一次矩阵乘完成打分，返回值与 index.search 形状一致。
+        """
+        ids = np.asarray(candidate_ids, dtype='int64')
+        scores = np.full((1, top_k), -np.inf, dtype='float32')
+        labels = np.full((1, top_k), -1, dtype='int64')
+        if ids.size == 0 or index.ntotal == 0:
+            return scores, labels
+
+        # 直接读取 id_map 的存储区（不复制）；主键按写入顺序递增时 id_map 有序，
+        # 二分查找即可得到存储位置，绕开 IDMap2 的哈希反查表（等价于 FAISS 的 Array 型 DirectMap）
+        id_map = faiss.rev_swig_ptr(index.id_map.data(), index.id_map.size())
+        if np.all(id_map[1:] > id_map[:-1]):
+            positions = np.searchsorted(id_map, ids).clip(max=id_map.size - 1)
+            found = id_map[positions] == ids
+            ids = ids[found]
+            if ids.size == 0:
+                return scores, labels
+            vectors = faiss.downcast_index(index.index).reconstruct_batch(positions[found])
+        else:
+            ids = ids[np.isin(ids, id_map)]
+            if ids.size == 0:
+                return scores, labels
+            vectors = index.reconstruct_batch(ids)
+        sims = vectors @ query_vector[0]
+        order = np.argsort(-sims)[:top_k]
+        scores[0, :order.size] = sims[order]
+        labels[0, :order.size] = ids[order]
+        return scores, labels
+
+    def search_knowledge(self, query_text, top_k=2, paper_candidates=None):
+        """
+        基于向量检索结果，从 SQLite 硬盘数据库回捞详尽元数据
 
-        D1, I1 = self.paper_index.search(query_vector, top_k)
-        D2, I2 = self.force_index.search(query_vector, top_k)
+        paper_candidates: 可选的论文 id 列表；给定时只在这些论文中打分排序，不做全库检索。
+        """
+        # 查询向量未命中缓存时，写入 emb_cache 交给后台线程，检索不等待写锁
+        query_vector = self.get_embeddings_batch([query_text], defer_cache_write=True)
+
+        # 只在取索引引用时短暂加锁；写入在副本上进行（见 _build_shadow），检索不会看到写了一半的索引
+        with self._index_lock:
+            paper_index, force_index = self.paper_index, self.force_index
+        if paper_candidates is not None:
+            D1, I1 = self._search_subset(paper_index, query_vector, paper_candidates, top_k)
+        else:
+            D1, I1 = paper_index.search(query_vector, top_k)
+        D2, I2 = force_index.search(query_vector, top_k)
 
         relevant_papers = []
         relevant_forces = []
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-
-            # 从 I1 (论文向量 ID 列表) 回捞
-            for v_id in I1[0]:
-                if v_id == -1: continue
-                cursor.execute("SELECT metadata_json FROM papers WHERE vector_id = ?", (int(v_id),))
-                res = cursor.fetchone()
-                if res: relevant_papers.append(json.loads(res[0]))
-
-            # 从 I2 (力场向量 ID 列表) 回捞
-            for v_id in I2[0]:
-                if v_id == -1: continue
-                cursor.execute("SELECT force_json, source_paper FROM force_fields WHERE vector_id = ?", (int(v_id),))
-                res = cursor.fetchone()
-                if res:
-                    f_data = json.loads(res[0])
-                    f_data['source_from'] = res[1]  # 附带来源信息
-                    relevant_forces.append(f_data)
+        paper_ids = [int(v_id) for v_id in I1[0] if v_id != -1]
+        force_ids = [int(v_id) for v_id in I2[0] if v_id != -1]
+
+        # 使用只读连接：入库事务进行中也能直接读取已提交的数据
+        with self._read_lock:
+            cursor = self._read_conn.cursor()
+
+            # 从 I1 (论文向量 ID 列表) 一次性回捞，再按 FAISS 返回的相似度顺序排列
+            if paper_ids:
+                placeholders = ",".join("?" * len(paper_ids))
+                cursor.execute(f"SELECT id, metadata_json FROM papers WHERE id IN ({placeholders})", paper_ids)
+                paper_rows = dict(cursor.fetchall())
+                for v_id in paper_ids:
+                    if v_id in paper_rows:
+                        relevant_papers.append(json.loads(paper_rows[v_id]))
+
+            # 从 I2 (力场向量 ID 列表) 一次性回捞
+            if force_ids:
+                placeholders = ",".join("?" * len(force_ids))
+                cursor.execute(f"SELECT id, force_blob, force_json, source_paper FROM force_fields "
+                               f"WHERE id IN ({placeholders})", force_ids)
+                force_rows = {row[0]: row[1:] for row in cursor.fetchall()}
+                for v_id in force_ids:
+                    if v_id in force_rows:
+                        force_blob, force_json, source_paper = force_rows[v_id]
+                        f_data = _unpack_record(force_blob) if force_blob is not None else json.loads(force_json)
+                        f_data['source_from'] = source_paper  # 附带来源信息
+                        relevant_forces.append(f_data)
 
         return relevant_papers, relevant_forces
 
@@ -519,9 +997,9 @@ class ComplexPlasmaRAG:
         """
         # RAG 检索逻辑
         # 增加安全获取逻辑，防止 keywords 中混入 int / float 导致 join 报错
-        title = structured_paper.get('metadata', {}).get('title', 'Unknown')
-        raw_keywords = structured_paper.get('keywords', [])
-        if isinstance(raw_keywords, (list, tuple, set)):
+        title = (structured_paper.get('metadata') or {}).get('title', 'Unknown')
+        raw_keywords = structured_paper.get('keywords')
+        if isinstance(raw_keywords, list) or isinstance(raw_keywords, (tuple, set)):
             keywords = [str(k) for k in raw_keywords]
         elif raw_keywords:
             keywords = [str(raw_keywords)]
@@ -590,186 +1068,302 @@ class ComplexPlasmaRAG:
         return completion.choices[0].message.content
 
     def get_embedding(self, text):
-        """调用阿里云配套 Embedding 模型"""
-        # 注意：这里需要对输入文本进行简单处理，确保它是字符串且不为空
-        if not text or not text.strip():
-            text = "empty_input_placeholder"  # 防止空字符串导致API报错
-        text = text.replace("\n", " ")
+        """调用阿里云配套 Embedding 模型，返回形状为 (1, 1536) 的向量"""
+        return self.get_embeddings_batch([text])
 
+    @staticmethod
+    def _embed_chunk(chunk, out):
+        """单次 Embedding 请求（不超过 EMBEDDING_BATCH_SIZE 条），结果按输入顺序直接写入 float32 缓冲区 out"""
         response = client.embeddings.create(
             model="text-embedding-v2",  # 配套的向量模型
-            input=text
+            input=chunk
         )
-        # 将结果转为 float32 的 numpy 数组，并增加一个维度 (1, 1536) 以适配 FAISS
-        return np.array(response.data[0].embedding).astype('float32').reshape(1, -1)
+        # 按 index 写入对应行，确保顺序与输入一致
+        for item in response.data:
+            out[item.index] = item.embedding
+
+    def get_embeddings_batch(self, texts, defer_cache_write=False):
+        """
+        批量调用 Embedding 模型：一次请求向量化多段文本。
+
+        返回形状为 (N, 1536)、已做 L2 归一化的 float32 数组，行顺序与 texts 一致。
+        DashScope 单次请求最多接受 EMBEDDING_BATCH_SIZE 条文本，超出时自动分批并发请求。
+        已向量化过的文本直接从 emb_cache 表读取，只有未命中的文本才会请求 API。
+        defer_cache_write=True 时新向量由后台线程写入 emb_cache（检索路径使用，不等待写锁）。
+        """
+        # 注意：这里需要对输入文本进行简单处理，确保它是字符串且不为空
+        cleaned = []
+        for text in texts:
+            if not text or not text.strip():
+                text = "empty_input_placeholder"  # 防止空字符串导致API报错
+            cleaned.append(text.replace("\n", " "))
+
+        # 输出缓冲区一次性分配，命中缓存与新请求的向量都直接写入对应行
+        vectors = np.empty((len(cleaned), self.dimension), dtype='float32')
+        key_rows = {}  # 内容哈希 -> 输出行号列表（相同文本只请求 / 解码一次）
+        for i, text in enumerate(cleaned):
+            key_rows.setdefault(hashlib.blake2b(text.encode(), digest_size=16).hexdigest(), []).append(i)
+
+        # 1. 查缓存：IN 查询按绑定参数上限分块
+        unique_keys = list(key_rows)
+        rows = []
+        with self._read_lock:
+            for start in range(0, len(unique_keys), SQL_MAX_VARIABLES):
+                chunk = unique_keys[start:start + SQL_MAX_VARIABLES]
+                rows.extend(self._read_conn.execute(
+                    f"SELECT h, vec FROM emb_cache WHERE h IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        for h, vec in rows:
+            vectors[key_rows.pop(h)] = np.frombuffer(vec, dtype='float32')
+
+        # 2. 未命中的文本（去重后）批量请求 API
+        if key_rows:
+            miss_keys = list(key_rows)
+            miss_texts = [cleaned[key_rows[key][0]] for key in miss_keys]
+            # 各分批请求的结果直接写入同一块 float32 缓冲区的对应切片，不再经由 Python 列表拼接
+            fresh = np.empty((len(miss_texts), self.dimension), dtype='float32')
+            starts = range(0, len(miss_texts), EMBEDDING_BATCH_SIZE)
+            chunks = [miss_texts[start:start + EMBEDDING_BATCH_SIZE] for start in starts]
+            outs = [fresh[start:start + EMBEDDING_BATCH_SIZE] for start in starts]
+            if len(chunks) == 1:
+                self._embed_chunk(chunks[0], outs[0])
+            else:
+                # 多个分批请求彼此独立，并发发出
+                with ThreadPoolExecutor(max_workers=min(len(chunks), EMBEDDING_MAX_CONCURRENCY)) as pool:
+                    list(pool.map(self._embed_chunk, chunks, outs))
+            # L2 归一化后，内积索引的得分即余弦相似度
+            faiss.normalize_L2(fresh)
+            for key, vec in zip(miss_keys, fresh):
+                vectors[key_rows[key]] = vec
+            cache_rows = [(key, vec.tobytes()) for key, vec in zip(miss_keys, fresh)]
+            if defer_cache_write:
+                self._cache_writer.submit(self._store_embeddings, cache_rows)
+            else:
+                self._store_embeddings(cache_rows)
+
+        return vectors
+
+    def _store_embeddings(self, cache_rows):
+        """新向量写入 emb_cache：整批在一个显式事务中写入，只提交一次（autocommit 下每行都是单独的事务）"""
+        try:
+            with self._transaction() as cursor:
+                cursor.executemany(SQL_INSERT_EMBEDDING, cache_rows)
+        except sqlite3.Error as e:
+            # 缓存写入失败不影响本次结果，下次未命中时重新请求即可
+            print(f"⚠️ 写入向量缓存失败: {e}")
 
     def _is_valid_physics_data(self, data):
         """
         质量校验逻辑：判断提取的数据是否具备物理研究价值
         """
+        if not data: return False
+        metadata = data.get('metadata') or {}
+        physics_context = data.get('physics_context') or {}
+
         # 1. 标题校验
-        title = data.get('metadata', {}).get('title', "")
+        title = metadata.get('title', "")
         if not title or "解析失败" in title or title == "Unknown":
             return False
 
         # 2. 核心物理内容校验
         # 如果 parameters 和 force_fields 同时为空，说明没提取到任何关键物理建模信息
-        if not data: return False
-        params = data.get('parameters', [])
-        forces = data.get('force_fields', [])
-        if not params and not forces:
+        if not data.get('parameters') and not data.get('force_fields'):
             print("⚠️ 质量校验失败：未提取到任何物理参数或力场信息。")
             return False
 
         # 3. 文本富化程度校验
         # 如果背景描述和创新点都是默认的 "None" 或 "Unknown"，说明理解失败
-        innovation = data.get('metadata', {}).get('innovation', "None")
-        background = data.get('physics_context', {}).get('detailed_background', "None")
-        if innovation in ["None", "Unknown"] and background in ["None", "Unknown"]:
+        innovation = metadata.get('innovation', "None")
+        background = physics_context.get('detailed_background', "None")
+        if innovation in ("None", "Unknown") and background in ("None", "Unknown"):
             print("⚠️ 质量校验失败：物理背景理解为空。")
             return False
 
         return True
 
-    def _safe_save_index(self, index, path):
-        """原子化保存 FAISS 索引"""
+    def _safe_save_index(self, index, path, lock=True):
+        """
+        原子化保存 FAISS 索引
+
+        lock=True 时写临时文件与替换期间持有 <索引>.lock 文件锁，防止多进程同时写同一文件；
+        文件名唯一的增量文件不会被并发写入，无需加锁。
+        """
         tmp_path = path + ".tmp"
         try:
-            faiss.write_index(index, tmp_path)
-            # os.replace 是原子的，确保文件完整性
-            os.replace(tmp_path, path)
+            with (portalocker.Lock(path + ".lock", timeout=10) if lock else nullcontext()):
+                faiss.write_index(index, tmp_path)
+                # os.replace 是原子的，确保文件完整性
+                os.replace(tmp_path, path)
         except Exception as e:
             if os.path.exists(tmp_path):
                 os.remove(tmp_path)
             raise IOError(f"保存索引失败: {e}")
 
+    @staticmethod
+    def _insert_returning(cursor, sql_template, rows):
+        """多行 INSERT ... RETURNING：按绑定参数上限分块执行，返回所有新插入行"""
+        if not rows:
+            return []
+        width = len(rows[0])
+        group = "(" + ", ".join("?" * width) + ")"
+        step = SQL_MAX_VARIABLES // width
+        results = []
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            cursor.execute(sql_template.format(",".join([group] * len(chunk))),
+                           [value for row in chunk for value in row])
+            results.extend(cursor.fetchall())
+        return results
+
     def update_vector_db(self, structured_data):
         """
-        持久化更新：查重 -> 写入SQLite -> 写入FAISS -> 同步到磁盘文件
+        持久化更新单篇论文：查重 -> 写入SQLite -> 写入FAISS -> 标记索引待落盘（见 flush）
         """
-        title = structured_data['metadata']['title']
+        self.update_vector_db_batch([structured_data])
 
-        # 1. 深度质量校验
-        if not self._is_valid_physics_data(structured_data):
-            print(f"❌ 数据质量未达标，不记录到数据库。请检查论文格式或 API 配额。")
+    def update_vector_db_batch(self, papers):
+        """
+        批量持久化多篇论文：全部文本一次批量向量化，共用一个事务，
+        新向量按索引各只做一次 add_with_ids，整批提交后索引文件只写回一次。任一写入失败时整批回滚。
+        """
+        # --- 准备阶段（锁外）：质量校验、哈希、JSON 序列化与向量化都是纯 CPU / 网络开销，不占用写锁 ---
+        prepared = []  # [(title, paper_json, figures, candidates, force_blobs, vec_offset)]
+        texts = []
+        for structured_data in papers:
+            # 1. 深度质量校验
+            if not self._is_valid_physics_data(structured_data):
+                print(f"❌ 数据质量未达标，不记录到数据库。请检查论文格式或 API 配额。")
+                continue
+            title = structured_data['metadata']['title']
+
+            # 2. 力场哈希：公式 + 物理环境；同一篇论文内的重复力场在此先行剔除
+            physics_context = structured_data.get('physics_context') or {}
+            env_val = physics_context.get('environment', 'unknown_env')
+            candidates = []  # [(f_hash, legacy_hash)]
+            force_blobs = []
+            force_features = []
+            seen_hashes = set()
+            for ff in structured_data.get("force_fields", []):
+                formula_str = ff.get('formula', 'unknown_formula') + env_val
+                f_hash = _formula_hash(formula_str)
+                if f_hash in seen_hashes:
+                    continue
+                seen_hashes.add(f_hash)
+                # 旧库中的力场以 MD5 作为键，查重时一并比对
+                legacy_hash = _legacy_formula_hash(formula_str) if xxhash is not None else f_hash
+                candidates.append((f_hash, legacy_hash))
+                force_blobs.append(_pack_record(ff))
+                force_features.append(
+                    f"Interparticle Interaction: {ff['name']}. Significance: {ff['physical_significance']}")
+
+            # 3. 待向量化文本：论文在前，候选力场紧随其后
+            background = physics_context.get('detailed_background', 'No background available')
+            prepared.append((title, _json_dumps(structured_data), structured_data.get("figures") or [],
+                             candidates, force_blobs, len(texts)))
+            texts.append(f"Title: {title}. Context: {background}")
+            texts.extend(force_features)
+
+        if not prepared:
             return
 
-        # 使用 portalocker 给索引文件加锁，防止多进程同时写入导致文件损坏
-        # 我们创建一个 .lock 文件作为信号灯
-        lock_path = self.db_path + ".lock"
+        # 4. 全部论文 + 候选力场一次性批量向量化（已入库的力场会命中 emb_cache，不产生额外请求）
+        all_vecs = self.get_embeddings_batch(texts)
 
+        # 多进程写者由 SQLite 自身协调：BEGIN IMMEDIATE 取得写锁，其他写者按 busy_timeout 排队等待；
+        # 索引文件只在 _safe_save_index 原子替换时短暂加文件锁
         try:
-            with portalocker.Lock(lock_path, timeout=10):
-                with sqlite3.connect(self.db_path) as conn:
-                    cursor = conn.cursor()
-                    # 开启显式事务：确保数据库和索引文件要么都成功，要么都失败
-                    conn.execute("BEGIN")
-
-                    # --- 1. 论文查重与写入 ---
-                    cursor.execute("SELECT id FROM papers WHERE title = ?", (title,))
-                    if cursor.fetchone():
-                        print(f"跳过已存在论文: {title}")
+            # _write_lock 让本进程内的写者串行：下一个写者一定基于已切换的索引构建副本。
+            # 检索路径不获取 _write_lock / _db_lock，整个入库过程中检索照常进行
+            with self._write_lock:
+                # 开启显式写事务：整批论文只有一次 COMMIT；事务只覆盖数据库写入
+                with self._transaction(immediate=True) as cursor:
+                    # --- 1. 论文 / 力场查重：各一次 IN 查询 ---
+                    titles = list({item[0] for item in prepared})
+                    placeholders = ",".join("?" * len(titles))
+                    cursor.execute(f"SELECT title FROM papers WHERE title IN ({placeholders})", titles)
+                    existing_titles = {row[0] for row in cursor.fetchall()}
+
+                    lookup = list({h for item in prepared for pair in item[3] for h in pair})
+                    existing_forces = set()
+                    if lookup:
+                        placeholders = ",".join("?" * len(lookup))
+                        cursor.execute(f"SELECT formula_hash FROM force_fields WHERE formula_hash IN ({placeholders})",
+                                       lookup)
+                        existing_forces = {row[0] for row in cursor.fetchall()}
+
+                    accepted = []  # 本批需要新写入的论文
+                    force_params, force_rows = [], []  # 力场插入参数 / all_vecs 中的行号
+                    for item in prepared:
+                        title, _, _, candidates, force_blobs, offset = item
+                        if title in existing_titles:
+                            print(f"跳过已存在论文: {title}")
+                            continue
+                        existing_titles.add(title)
+                        accepted.append(item)
+
+                        # 库中已有相似背景下的相同公式，或本批次其他论文已带入的力场，跳过
+                        for i, (f_hash, legacy_hash) in enumerate(candidates):
+                            if f_hash in existing_forces or legacy_hash in existing_forces:
+                                continue
+                            existing_forces.add(f_hash)
+                            force_params.append((f_hash, force_blobs[i], title))
+                            force_rows.append(offset + 1 + i)
+
+                    if not accepted:
                         return
-                    else:
-                        # paper_text = f"Title: {title}. Context: {structured_data['physics_context']['detailed_background']}"
-                        background = structured_data.get('physics_context', {}).get('detailed_background',
-                                                                                    'No background available')
-                        paper_text = f"Title: {title}. Context: {background}"
-                        paper_vec = self.get_embedding(paper_text)
-
-                        # 写入 FAISS 内存并获取当前的索引位置
-                        # vector_id = self.paper_index.ntotal
-                        # self.paper_index.add(paper_vec)
-
-                        # 写入 SQLite 和磁盘文件
-                        # cursor.execute("INSERT INTO papers (title, metadata_json, vector_id) VALUES (?, ?, ?)",
-                        #                (title, json.dumps(structured_data), vector_id))
-
-                        # 1. 先存数据库，拿到自增 ID
-                        # 使用自增的显式 id（如从 SQLite 获得的 paper row id，或用 time-based int id）
-                        cursor.execute("INSERT INTO papers (title, metadata_json, vector_id) VALUES (?, ?, ?)",
-                                       (title, json.dumps(structured_data), -1))
-                        paper_row_id = cursor.lastrowid
-
-                        # 2. 把这个 ID 同步给 FAISS
-                        # 用 paper_row_id 作为外部向量 id
-                        self.paper_index.add_with_ids(paper_vec, np.array([paper_row_id], dtype='int64'))
-
-                        # 3. 更新数据库中的 vector_id 字段
-                        # 然后更新 DB 的 vector_id 字段为 paper_row_id
-                        cursor.execute("UPDATE papers SET vector_id = ? WHERE id = ?",
-                                       (int(paper_row_id), paper_row_id))
-
-                        # 4. 立即写回磁盘
-                        # faiss.write_index(self.paper_index, self.paper_idx_path)
-                        self._safe_save_index(self.paper_index, self.paper_idx_path)
+
+                    # --- 2. 论文写入：多行 INSERT ... RETURNING；主键 id 即 FAISS 外部向量 id ---
+                    title_ids = {title: row_id for row_id, title in
+                                 self._insert_returning(cursor, SQL_INSERT_PAPERS,
+                                                        [(item[0], item[1]) for item in accepted])}
+                    paper_ids = np.array([title_ids[item[0]] for item in accepted], dtype='int64')
+                    paper_rows = [item[5] for item in accepted]
+
+                    # --- 3. 图片信息入库（单次 executemany） ---
+                    figure_params = []
+                    for paper_row_id, (title, _, figures, _, _, _) in zip(paper_ids.tolist(), accepted):
                         print(f"✅ 论文已存入: {title} (ID: {paper_row_id})")
+                        if figures:
+                            figure_params.extend((paper_row_id, fig.get("image_path"), fig.get("caption"),
+                                                  fig.get("page")) for fig in figures)
+                            print(f"✅ 图片已存入: {title} (ID: {paper_row_id}, 共 {len(figures)} 张)")
+                    if figure_params:
+                        cursor.executemany(SQL_INSERT_FIGURE, figure_params)
+
+                    # --- 4. 力场写入 ---
+                    # INSERT OR IGNORE ... RETURNING：只有真正插入的力场才拿到 id 并进入 FAISS；
+                    # 主键 id 即 FAISS 外部向量 id，无需再回填 vector_id
+                    inserted = {f_hash: row_id for row_id, f_hash in
+                                self._insert_returning(cursor, SQL_INSERT_FORCES, force_params)}
+                    if len(inserted) < len(force_params):
+                        force_rows = [row for row, params in zip(force_rows, force_params) if params[0] in inserted]
+                    force_ids = np.array([inserted[params[0]] for params in force_params if params[0] in inserted],
+                                         dtype='int64')
+
+                    staged = [("paper", all_vecs[paper_rows], paper_ids)]
+                    if force_ids.size:
+                        staged.append(("force", all_vecs[force_rows], force_ids))
+
+                # --- 5. 事务已提交、写连接已释放：在索引副本上追加本批全部新向量（必要时重建为 HNSW），
+                # 再短暂加锁切换索引引用。若构建失败，已提交的记录在下次启动时由 _rebuild_from_db 补回索引 ---
+                for kind, vectors, ids in staged:
+                    index, rebuilt = self._build_shadow(kind, vectors, ids)
+                    self._publish_index(kind, index, rebuilt, vectors, ids)
+
+            # 新增向量积累到 INDEX_FLUSH_DIRTY_LIMIT 才立即落盘，否则只标记为脏，由定时器 / 退出时统一写回磁盘；
+            # 落盘前崩溃也不丢数据：SQLite 已提交，下次启动时可按库重建索引（见 _rebuild_from_db）
+            if self._dirty_adds >= INDEX_FLUSH_DIRTY_LIMIT:
+                self.flush()
+            else:
+                self._schedule_flush()
 
-                    # --- 2. 新增：图片信息入库 ---
-                    if "figures" in structured_data:
-                        for fig in structured_data["figures"]:
-                            print(
-                                f"[update_vector_db] storing figure for paper={title}, image_path={fig.get('image_path')}")
-                            cursor.execute('''
-                                INSERT INTO figures (paper_id, image_path, caption, page_num)
-                                VALUES (?, ?, ?, ?)
-                            ''', (
-                                paper_row_id,
-                                fig.get("image_path"),
-                                fig.get("caption"),
-                                fig.get("page")
-                            ))
-                        print(f"✅ 图片已存入: {title} (ID: {paper_row_id})")
-
-                    # --- 2. 力场查重与写入 ---
-                    if "force_fields" in structured_data:
-                        for ff in structured_data["force_fields"]:
-                            # 生成唯一特征哈希：公式 + 物理环境
-                            # formula_str = ff['formula'] + structured_data['physics_context']['environment']
-                            # 修改后（更安全）
-                            formula_val = ff.get('formula', 'unknown_formula')
-                            env_val = structured_data.get('physics_context', {}).get('environment', 'unknown_env')
-                            formula_str = formula_val + env_val
-
-                            f_hash = hashlib.md5(formula_str.encode()).hexdigest()
-
-                            cursor.execute("SELECT id FROM force_fields WHERE formula_hash = ?", (f_hash,))
-                            if cursor.fetchone():
-                                continue  # 相似背景下的相同公式，跳过
-
-                            force_feature = f"Interparticle Interaction: {ff['name']}. Significance: {ff['physical_significance']}"
-                            force_vec = self.get_embedding(force_feature)
-
-                            # f_vector_id = self.force_index.ntotal
-                            # self.force_index.add(force_vec)
-                            #
-                            # cursor.execute(
-                            #     "INSERT INTO force_fields (formula_hash, force_json, source_paper, vector_id) VALUES (?, ?, ?, ?)",
-                            #     (f_hash, json.dumps(ff), title, f_vector_id))
-
-                            # 1. 先存数据库拿到 ID
-                            cursor.execute(
-                                "INSERT INTO force_fields (formula_hash, force_json, source_paper, vector_id) VALUES (?, ?, ?, ?)",
-                                (f_hash, json.dumps(ff), title, -1))
-                            db_force_id = cursor.lastrowid
-
-                            # 2. 同步 ID 到力场索引
-                            self.force_index.add_with_ids(force_vec, np.array([db_force_id], dtype='int64'))
-
-                            # 3. 回填 vector_id
-                            cursor.execute("UPDATE force_fields SET vector_id = ? WHERE id = ?",
-                                           (db_force_id, db_force_id))
-
-                        # faiss.write_index(self.force_index, self.force_idx_path)
-                        self._safe_save_index(self.force_index, self.force_idx_path)
-
-                    conn.commit()
-
-        except portalocker.exceptions.LockException:
-            print("❌ 无法获取文件锁，可能有其他进程正在写入。")
         except Exception as e:
-            print(f"❌ 数据库更新发生错误: {e}")
-            # 这里自动触发 rollback (因为在 with sqlite3.connect 块内)
+            # 只有 "database is locked" / busy 才是写锁等待超时，其他 OperationalError（缺表、磁盘 I/O 等）按一般错误报告
+            msg = str(e)
+            if isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg):
+                print(f"❌ 数据库写锁等待超时，可能有其他进程正在写入: {e}")
+            else:
+                print(f"❌ 数据库更新发生错误: {e}")
+            # 事务已在 _transaction 中自动 rollback
 
 
 if __name__ == "__main__":
@@ -6,59 +6,144 @@ Compatible with Gradio 6.5.1
 """
 import os
 import json
-import sqlite3
-import base64
-import tempfile
 import pathlib
 import html as html_escape
 import re
-import dashscope
+import sqlite3
+import functools
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
 import gradio as gr
 import pandas as pd
-from backend import ComplexPlasmaRAG
+from backend import ComplexPlasmaRAG, connect_db
+
+try:
+    import orjson  # 可选：C 实现的 JSON 解析，比标准库快数倍
+except ImportError:
+    orjson = None
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _dumps_pretty(obj):
+    """缩进 2 格、保留非 ASCII 字符的 JSON 文本；装有 orjson 时用它序列化（default=dict 兼容 MappingProxyType）"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=dict, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=dict)
 
 # Version information
 __version__ = "1.0.1"
 
 # Base directory of this app (used to resolve demo asset paths like images/)
 BASE_DIR = pathlib.Path(__file__).resolve().parent
+# 路径热路径上使用 os.path 字符串运算，比逐次构造 pathlib.Path 更快
+BASE_DIR_STR = str(BASE_DIR)
+_BASE_PREFIX = os.path.join(BASE_DIR_STR, "")
+
+# 设置环境变量 PLASMARAG_DEBUG 后输出路径解析等调试信息（逐图片的日志默认关闭，不占用 stdout）
+DEBUG = bool(os.getenv("PLASMARAG_DEBUG"))
 
 
 # ---- 路径相关小工具 ----
+# 已是规范相对路径的快速判定：正斜杠分隔、非绝对路径，且每段都不是空段 / "." / ".."
+_FAST_REL_PATH_RE = re.compile(r"(?:[\w-][\w.-]*/)*[\w-][\w.-]*\Z")
+
+
 def normalize_figure_path(path: str) -> str:
     """
     将任意形式的路径统一规范为【绝对路径 + 正斜杠】，便于 Gradio 的 file= 协议访问。
 
     核心思路：
     - 统一转为以 BASE_DIR 为基准的绝对路径（即当前前端脚本所在目录）；
-    - 使用 Path.resolve() 明确真实位置，避免工作目录变化带来的相对路径偏移；
+    - 使用 os.path.normpath 明确位置（不访问文件系统），避免工作目录变化带来的相对路径偏移；
     - 将 Windows 的 "\\" 变成 "/"，与浏览器 / Gradio 的 /file= 协议兼容。
     """
     if not path:
         return ""
     path_str = str(path)
+    # 常见情形（如 images/image1.png）规范化后与输入相同，直接返回
+    if _FAST_REL_PATH_RE.match(path_str):
+        return path_str
+    # 后端写入的项目内绝对路径：去掉 BASE_DIR 前缀后若已是规范相对路径，直接返回
+    if path_str.startswith(_BASE_PREFIX):
+        rel = path_str[len(_BASE_PREFIX):]
+        if _FAST_REL_PATH_RE.match(rel):
+            return rel
+    return _normalize_cached(path_str)
+
+
+@functools.lru_cache(maxsize=2048)
+def _normalize_cached(path_str: str) -> str:
+    """normalize_figure_path 的实际实现：BASE_DIR 在导入时即已固定，结果只取决于输入路径，可安全缓存"""
     if path_str.startswith(("http://", "https://", "data:")):
         return path_str
     try:
-        p = pathlib.Path(path_str)
-        # 如果是绝对路径且在项目目录下，转换为相对 BASE_DIR 的路径
-        if p.is_absolute():
-            try:
-                p = p.resolve().relative_to(BASE_DIR)
-            except ValueError:
-                # 不在项目目录内时，退化为仅使用文件名，避免跨盘符问题
-                p = pathlib.Path(p.name)
+        # 以 BASE_DIR 为基准拼接并规范化（相对路径据此解析，绝对路径保持不变），再转回相对路径
+        full = os.path.normpath(os.path.join(BASE_DIR_STR, path_str))
+        if full.startswith(_BASE_PREFIX) or full == BASE_DIR_STR:
+            rel = full[len(_BASE_PREFIX):] or "."
+        elif os.path.isabs(path_str):
+            # 不在项目目录内的绝对路径，退化为仅使用文件名，避免跨盘符问题
+            rel = os.path.basename(full)
         else:
-            # 相对路径：以 BASE_DIR 为基准解析，再转回相对路径，保证规范化
-            p = (BASE_DIR / p).resolve().relative_to(BASE_DIR)
-        normalized = p.as_posix()
-        print(f"[normalize_figure_path] raw={path_str}, normalized_rel={normalized}, exists={(BASE_DIR / p).exists()}")
+            raise ValueError("相对路径超出项目目录")
+        normalized = rel.replace(os.sep, "/")
+        if DEBUG:
+            print(f"[normalize_figure_path] raw={path_str}, normalized_rel={normalized}, "
+                  f"exists={os.path.exists(os.path.join(BASE_DIR_STR, rel))}")
         return normalized
     except Exception as e:
-        print(f"[normalize_figure_path] 路径转换失败: {e}, raw={path_str}")
+        if DEBUG:
+            print(f"[normalize_figure_path] 路径转换失败: {e}, raw={path_str}")
         return path_str
 
 
+# 图片目录列表缓存：目录（相对 BASE_DIR）-> (列出时刻, 目录下的文件名集合)。
+# 同一目录下的多张图片只需一次 scandir，之后按文件名查集合；超过 TTL 或新论文入库后重新列出
+_FIGURE_DIR_TTL = 30.0
+_figure_dir_cache = {}
+_figure_dir_lock = threading.Lock()
+
+
+def _dir_files(rel_dir):
+    """返回目录下的文件名集合（目录不存在时为空集合）"""
+    now = time.monotonic()
+    with _figure_dir_lock:
+        hit = _figure_dir_cache.get(rel_dir)
+    if hit is not None and now - hit[0] < _FIGURE_DIR_TTL:
+        return hit[1]
+    try:
+        with os.scandir(os.path.join(BASE_DIR_STR, rel_dir)) as entries:
+            names = frozenset(entry.name for entry in entries if entry.is_file())
+    except OSError:
+        names = frozenset()
+    with _figure_dir_lock:
+        _figure_dir_cache[rel_dir] = (now, names)
+    return names
+
+
+def clear_figure_dir_cache():
+    """清空图片目录列表缓存（有新论文的图片写入后调用）"""
+    with _figure_dir_lock:
+        _figure_dir_cache.clear()
+
+
+def _resolve_figure(raw):
+    """
+    返回 (规范化后的相对路径, 是否为存在的文件)。
+
+    normalize_figure_path 的结果已经解析过（且被缓存）；存在性按所在目录的文件名集合判断（见 _dir_files），
+    同一目录下的多张图片不再逐个 stat。
+    """
+    norm = normalize_figure_path(raw)
+    if not norm:
+        return "", False
+    rel_dir, name = os.path.split(norm)
+    return norm, name in _dir_files(rel_dir)
+
+
 def extract_figure_paths(structured_data):
     """从结构化数据中提取用于 Gallery 展示的图片及文字说明列表。
 
@@ -66,30 +151,23 @@ def extract_figure_paths(structured_data):
     """
     if not structured_data:
         return []
-    figs = structured_data.get("figures", []) or []
     paths = []
-    for f in figs:
+    # 循环内用到的函数绑定为局部变量，省去每张图的全局查找
+    append, resolve = paths.append, _resolve_figure
+    for f in structured_data.get("figures", []) or []:
         raw = f.get("image_path", "")
         if not raw:
             continue
-        norm = normalize_figure_path(raw)
-        if not norm:
-            continue
-        full_path = (BASE_DIR / norm).resolve()
-        if full_path.is_file():
+        norm, exists = resolve(raw)
+        if exists:
             # 组合图注：优先使用 caption，其次可附带页码信息
             caption = f.get("caption", "") or ""
             page = f.get("page", None)
             if page is not None:
-                if caption:
-                    caption_text = f"Page {page} · {caption}"
-                else:
-                    caption_text = f"Page {page}"
-            else:
-                caption_text = caption
-            paths.append([norm, caption_text])
-        else:
-            print(f"[extract_figure_paths] 跳过非文件路径: raw={raw}, norm={norm}, full={full_path}")
+                caption = f"Page {page} · {caption}" if caption else f"Page {page}"
+            append([norm, caption])
+        elif norm and DEBUG:
+            print(f"[extract_figure_paths] 跳过非文件路径: raw={raw}, norm={norm}, full={os.path.join(BASE_DIR_STR, norm)}")
     return paths
 
 
@@ -239,8 +317,9 @@ DEMO_STRUCTURED_DATA = {
 }
 
 # ---- Simulation Setup 视图推荐卡片的调试用示例 JSON ----
-DEMO_RECOMMENDATION_JSON = {
-    "parameter_recommendations": {
+# 示例推荐为只读常量：外层与两个子字典都包装为 MappingProxyType，渲染函数无法修改，调用方也无需深拷贝
+DEMO_RECOMMENDATION_JSON = MappingProxyType({
+    "parameter_recommendations": MappingProxyType({
         "target_particle_charge": {
             "range": [10000.0, 15000.0],
             "step": 500.0,
@@ -259,47 +338,62 @@ DEMO_RECOMMENDATION_JSON = {
             "unit": "mm",
             "reason": "文献中 λ ≈ 0.05 mm（parameters[5]），但该值对应低压（8–15 Pa）Ar 气及典型电子温度；用户指定 λ = 0.6 mm，比文献值大 12×，表明系统更稀薄或 T_e 更高；根据德拜长度定义 λ_D = √(ε₀ k_B T_e / (n_e e²))，增大 λ 需降低 n_e 或提高 T_e；为维持可观测的尾流各向异性（∝ M_T² λ²/r²），必须保证 κ = λ/Δ ≥ 5（parameters[8]，κ=7.7），即平均粒间距 Δ ≤ λ/5 = 0.12 mm；对应粒子数密度 n ≥ (1/Δ)³ ≈ 6×10⁵ cm⁻³ —— 此值高于文献 n≈3×10⁴ cm⁻³，但仍在 PK-3 Plus 可达范围（高功率放电可提升 n_e）；因此 λ=0.6 mm 是可行且有利于增强长程各向异性作用（W ∝ e⁻ʳ⁄λ），促进链稳定；区间 [0.4, 0.8] mm 覆盖弱至强屏效过渡，步长 0.05 mm 可分辨 λ 对序参量 Δα 的幂律依赖（simulation_results_description 中 Δα ∝ M_T^β）。单位严格为 'mm'。"
         }
-    },
-    "force_field_recommendation": {
+    }),
+    "force_field_recommendation": MappingProxyType({
         "name": "场致电变流体对势（Electrorheological Pair Potential）",
         "reason": "该力场显式包含各向异性项 −0.43 M_T² (3cos²θ−1)/(r/λ)，直接编码了外加交变电场下离子尾流诱导的偶极类相互作用（physical_significance），且其角依赖性（cos²θ）在 θ=0（沿电场方向）产生净吸引，驱动一维链状有序（observed_phenomena）；相比 '时间平均尾流势'，此势已是静态有效对势，可直接用于分子动力学模拟，无需实时求解等离子体响应；文献明确指出其适用于研究各向异性相变行为（computational_hint），且模拟结果与微重力实验高度吻合（simulation_results_description）；而 '时间平均尾流势' 仅描述单粒子势场，不满足粒子间相互作用建模需求。"
-    }
-}
+    })
+})
 
 # ---- 后端实例（不要在前端传 API key） ----
 # ComplexPlasmaRAG 内部应读取环境变量 DASHSCOPE_API_KEY
 MY_API_KEY = os.getenv("DASHSCOPE_API_KEY", "sk-fd7afdef962a46d39784e8b0b8133974")
+# 模型调用全部经由后端的 OpenAI 兼容接口，前端不再导入 dashscope SDK（导入耗时且从未被调用）
 rag_system = ComplexPlasmaRAG(api_key=MY_API_KEY)
-dashscope.api_key = MY_API_KEY
+
+# 界面只读查询共用一个连接（首次使用时打开），避免每次点击都重新建连并协商 PRAGMA；
+# sqlite3 连接不能被多个线程同时使用，因此用锁串行化
+_read_conn = None
+_read_conn_lock = threading.Lock()
+
+
+@contextmanager
+def db_connection():
+    """持锁借用共享的只读连接：with db_connection() as conn: ..."""
+    global _read_conn
+    with _read_conn_lock:
+        if _read_conn is None:
+            _read_conn = connect_db(rag_system.db_path, check_same_thread=False)
+        yield _read_conn
 
 
 # ---- 小工具 ----
 def safe_json_load(s):
+    """解析 JSON 文本，失败（格式错误或类型不对）时返回 None；装有 orjson 时优先使用"""
     try:
-        return json.loads(s)
-    except:
+        return _loads(s)
+    except (ValueError, TypeError):
         return None
 
 
+# 进度条各步骤的 HTML 片段在导入时预先生成：_PROGRESS_STEP_HTML[i] = (已完成, 未完成)
+_PROGRESS_LABELS = ("Upload", "Parsing", "Physics Extraction", "Embedding", "Indexed")
+_PROGRESS_STEP_HTML = tuple(
+    tuple(f'<div style="margin:6px 0;"><span style="color:{color};font-weight:600;margin-right:8px">{sym}</span>{lab}</div>'
+          for color, sym in (("#16a34a", "✅"), ("#9ca3af", "○")))
+    for lab in _PROGRESS_LABELS
+)
+
+
 def render_progress_html(steps_done):
     # steps_done: list of bool states [upload, parsing, extraction, embedding, indexed]
-    labels = ["Upload", "Parsing", "Physics Extraction", "Embedding", "Indexed"]
-    html = '<div style="font-family:Inter, Arial, sans-serif;">'
-    for i, lab in enumerate(labels):
-        ok = steps_done[i]
-        color = "#16a34a" if ok else "#9ca3af"
-        sym = "✅" if ok else "○"
-        html += f'<div style="margin:6px 0;"><span style="color:{color};font-weight:600;margin-right:8px">{sym}</span>{lab}</div>'
-    html += "</div>"
-    return html
-
+    return ('<div style="font-family:Inter, Arial, sans-serif;">'
+            + "".join(done if ok else pending for (done, pending), ok in zip(_PROGRESS_STEP_HTML, steps_done))
+            + "</div>")
 
-def card_css():
-    """全局样式：工作台布局 + 卡片 + 参数网格 + 力场卡片。
 
-    仅包含 CSS，不包含脚本；数学公式渲染交给 Gradio 的 Markdown / KaTeX。
-    """
-    return """
+# 全局样式：工作台布局 + 卡片 + 参数网格 + 力场卡片（静态内容，导入时构造一次）
+_CARD_CSS = """
     <style>
       :root {
         --paper-bg: #f9fafb;
@@ -636,7 +730,15 @@ def card_css():
         max-height:260px;
       }
     </style>
+"""
+
+
+def card_css():
+    """全局样式：工作台布局 + 卡片 + 参数网格 + 力场卡片。
+
+    仅包含 CSS，不包含脚本；数学公式渲染交给 Gradio 的 Markdown / KaTeX。
     """
+    return _CARD_CSS
 
 
 # ---- 页面组件行为函数 ----
@@ -672,6 +774,9 @@ def process_pdf_step(file):
         progress_html = render_progress_html(steps)
 
         # render cards：顶部摘要 + 底部详细内容 + 图像路径（供 Gallery 使用）
+        # 新图片已写盘，目录列表需重新读取；论文库列表也随之失效
+        clear_figure_dir_cache()
+        clear_library_cache()
         header_md = render_header_html(structured_json)
         body_md = render_body_html(structured_json)
         fig_paths = extract_figure_paths(structured_json)
@@ -691,194 +796,208 @@ def process_pdf_step(file):
 def load_demo_case():
     """
     加载内置示例论文（用于前端渲染测试，不调用后端 API）。
-    输出签名与 process_pdf_step 一致，便于复用 UI。
+    输出签名与 process_pdf_step 一致，便于复用 UI；渲染结果在导入时已预先生成（见 _DEMO_HEADER 等）。
     """
-    steps = [True] * 5
-    progress_html = render_progress_html(steps)
-    structured_json = DEMO_STRUCTURED_DATA
-    header_md = render_header_html(structured_json)
-    body_md = render_body_html(structured_json)
-    fig_paths = extract_figure_paths(structured_json)
     status = "✅ 已加载示例论文"
-    return status, progress_html, header_md, body_md, structured_json, fig_paths
+    return status, _DEMO_PROGRESS, _DEMO_HEADER, _DEMO_BODY, DEMO_STRUCTURED_DATA, _DEMO_FIGS
+
+
+# ---- 论文卡片 HTML 模板：静态结构一次写好，渲染时只做一次 format 填充可变片段 ----
+_INVALID_DATA_HTML = "<div class='paper-workbench'>⚠️ 未能提取到有效数据</div>"
+
+_HEADER_TMPL = (
+    "<div class='paper-workbench'>"
+    "<div class='paper-header'>"
+    "<div class='paper-title'>{title}</div>"
+    "{meta_line}"
+    "{innovation}"
+    "</div>"  # end header
+    "</div>"  # end workbench
+)
+
+_BODY_TMPL = (
+    "<div class='paper-workbench'>"
+    # 主体两列布局
+    "<div class='paper-main-grid'>"
+    # 左列：物理背景 + 关键图表 + 观测现象
+    "<div class='paper-main-left'>"
+    "<div class='paper-card paper-card-physics'>"
+    "<h3>物理背景与环境</h3>"
+    "<p><strong>环境：</strong>{env}</p>"
+    "{background}"
+    "</div>"
+    "{figures_html}"
+    "{phenomena_html}"
+    "</div>"  # end left
+    # 右列：参数 grid（按物理属性分组） + 力场
+    "<div class='paper-main-right'>"
+    "<div class='paper-card'>"
+    "<div class='param-section-header'>"
+    "<div class='param-section-title'>提取的关键物理参数</div>"
+    "<div class='param-section-sub'>按几何 / 电学 / 无量纲进行分组展示</div>"
+    "</div>"
+    "{params_html}"
+    "</div>"  # end param card
+    "<div class='paper-card force-section'>"
+    "<h3>相互作用力场</h3>"
+    "{forces_html}"
+    "</div>"  # end force section
+    "</div>"  # end right
+    "</div>"  # end main grid
+    "</div>"  # end workbench
+)
+
+# 关键图表的真实图片由 Gradio Gallery 组件负责，这里只保留占位标题（避免重复渲染）
+_FIGURES_PLACEHOLDER_HTML = (
+    "<div class='paper-card'>"
+    "<h3>关键图表 (Scientific Figures)</h3>"
+    "<div class='param-section-sub'>下方 Gallery 中展示从 PDF 自动提取的页面快照或图表。</div>"
+    "</div>"
+)
+
+_PHENOMENA_TMPL = (
+    "<div class='phenomena-card'>"
+    "<div class='phenomena-title'>Observed Phenomena</div>"
+    "<div class='phenomena-body'>{phenomena}</div>"
+    "</div>"
+)
+
+_PARAM_GROUP_TMPL = (
+    "<div class='param-section-header' style='margin-top:4px;'>"
+    "<div class='param-section-title'>{category}</div>"
+    "</div>"
+    "<div class='param-grid'>{cards}</div>"
+)
+
+_PARAM_CATEGORY_ORDER = ("几何参数", "电学参数", "无量纲与控制参数", "其他参数")
+
+# 参数分类规则：(类别, 名称关键词, 符号关键词)，按顺序匹配，关键词预编译为单个交替正则
+_PARAM_CATEGORY_RULES = (
+    # 几何相关：直径、长度、间距等
+    ("几何参数", re.compile("直径|长度|间距"), re.compile(r" d |\\lambda|\\Delta")),
+    # 电学相关：电压、电荷、频率等
+    ("电学参数", re.compile("电压|频率|电荷|电场"), re.compile(r"U_\{pp\}| f | Q ")),
+)
+# 无量纲 / 控制参数（另外单位中含“无量纲”也归入此类）
+_DIMENSIONLESS_NAME_RE = re.compile("马赫|参数|Mach|耦合")
+
+
+def _param_category(p):
+    """按名称 / 符号 / 单位把参数归入 _PARAM_CATEGORY_ORDER 中的一类"""
+    name = p.get("name", "")
+    sym = p.get("symbol", "")
+    for category, name_re, sym_re in _PARAM_CATEGORY_RULES:
+        if name_re.search(name) or sym_re.search(sym):
+            return category
+    if "无量纲" in p.get("unit", "") or _DIMENSIONLESS_NAME_RE.search(name):
+        return "无量纲与控制参数"
+    # 其余（如数密度等）
+    return "其他参数"
+
+
+# 论文字段来自 LLM 抽取结果，插入 HTML 前统一转义；单次 str.translate 扫描，等价于 html.escape
+_HTML_TRANS = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+
+def _esc(value):
+    return str(value).translate(_HTML_TRANS)
+
+
+def _optional_div(css_class, text, prefix=""):
+    """字段非空时转义后渲染为 <div class='css_class'>，否则返回空串"""
+    return f"<div class='{css_class}'>{prefix}{_esc(text)}</div>" if text else ""
+
+
+_PARAM_CARD_TMPL = "<div class='param-card'>{symbol}{value}{unit}{name}{meaning}</div>"
+
+
+def _render_param_card(p):
+    """单个参数卡片：符号 / 数值 / 单位 / 名称 / 含义，缺省字段不渲染；整张卡片一次 format 拼出"""
+    return _PARAM_CARD_TMPL.format(
+        symbol=_optional_div("param-symbol", p.get("symbol", "")),
+        value=_optional_div("param-value", p.get("value", "")),
+        unit=_optional_div("param-unit", p.get("unit", "")),
+        name=_optional_div("param-name", p.get("name", "")),
+        meaning=_optional_div("param-meaning", p.get("meaning", "")),
+    )
+
+
+def _render_force_card(f):
+    """单个力场卡片；公式保留 LaTeX，在 Markdown + KaTeX 环境下渲染"""
+    formula = f.get("formula", "").strip()
+    return ("<div class='force-card'>"
+            f"<div class='force-name'>{_esc(f.get('name', ''))}</div>"
+            # 公式交给 KaTeX 渲染，不做转义
+            + (f"<div class='force-formula'>$$ {formula} $$</div>" if formula else "")
+            + _optional_div("force-text", f.get("physical_significance", ""), "物理本质：")
+            + _optional_div("force-text", f.get("computational_hint", ""), "计算建议：")
+            + "</div>")
 
 
 def render_header_html(data):
     """渲染顶部元数据卡片：标题 + 期刊 + 年份 + 创新点。"""
     if not data or "metadata" not in data:
-        return "<div class='paper-workbench'>⚠️ 未能提取到有效数据</div>"
+        return _INVALID_DATA_HTML
 
     meta = data.get("metadata", {})
-    title = meta.get("title", "未知标题")
-    journal = meta.get("journal", "")
-    year = meta.get("year", "")
-    innovation = meta.get("innovation", "")
-
-    html = []
-    html.append("<div class='paper-workbench'>")
-    html.append("<div class='paper-header'>")
-    html.append(f"<div class='paper-title'>{title}</div>")
     # year 可能是 int，这里统一转成字符串，避免 join 抛出类型错误
-    meta_pieces = [journal, year]
-    meta_pieces = [str(x) for x in meta_pieces if x not in (None, "")]
-    meta_line = " · ".join(meta_pieces)
-    if meta_line:
-        html.append(f"<div class='paper-meta-line'>{meta_line}</div>")
-    if innovation:
-        html.append(f"<div class='paper-meta-line'>创新：{innovation}</div>")
-    html.append("</div>")  # end header
-    html.append("</div>")  # end workbench
-    return "".join(html)
+    meta_line = " · ".join(str(x) for x in (meta.get("journal", ""), meta.get("year", "")) if x not in (None, ""))
+    return _HEADER_TMPL.format(
+        title=_esc(meta.get("title", "未知标题")),
+        meta_line=_optional_div("paper-meta-line", meta_line),
+        innovation=_optional_div("paper-meta-line", meta.get("innovation", ""), "创新："),
+    )
 
 
 def render_body_html(data):
     """渲染底部详细内容：物理背景、现象、参数、力场等（不包含图像本身）。"""
     if not data or "metadata" not in data:
-        return "<div class='paper-workbench'>⚠️ 未能提取到有效数据</div>"
+        return _INVALID_DATA_HTML
 
-    meta = data.get("metadata", {})
     ctx = data.get("physics_context", {})
     params = data.get("parameters", [])
     forces = data.get("force_fields", [])
     figures = data.get("figures", []) or []
     phenomena = data.get("observed_phenomena", "")
-
-    env = ctx.get("environment", "N/A")
     bg = ctx.get("detailed_background", "")
 
-    html = []
-    html.append("<div class='paper-workbench'>")
-    # 主体两列布局
-    html.append("<div class='paper-main-grid'>")
-
-    # 左列：物理背景 + 关键图表 + 观测现象
-    html.append("<div class='paper-main-left'>")
-    html.append("<div class='paper-card paper-card-physics'>")
-    html.append("<h3>物理背景与环境</h3>")
-    html.append(f"<p><strong>环境：</strong>{env}</p>")
-    if bg:
-        html.append(f"<p>{bg}</p>")
-    html.append("</div>")
-
-    # 关键图表的真实图片由 Gradio Gallery 组件负责，这里只保留占位标题（避免重复渲染）
-    if figures:
-        html.append("<div class='paper-card'>")
-        html.append("<h3>关键图表 (Scientific Figures)</h3>")
-        html.append("<div class='param-section-sub'>下方 Gallery 中展示从 PDF 自动提取的页面快照或图表。</div>")
-        html.append("</div>")
-
-    if phenomena:
-        html.append("<div class='phenomena-card'>")
-        html.append("<div class='phenomena-title'>Observed Phenomena</div>")
-        html.append(f"<div class='phenomena-body'>{phenomena}</div>")
-        html.append("</div>")
-
-    html.append("</div>")  # end left
-
-    # 右列：参数 grid + 力场
-    html.append("<div class='paper-main-right'>")
-
-    # 参数 grid（按物理属性分组）
-    html.append("<div class='paper-card'>")
-    html.append(
-        "<div class='param-section-header'>"
-        "<div class='param-section-title'>提取的关键物理参数</div>"
-        "<div class='param-section-sub'>按几何 / 电学 / 无量纲进行分组展示</div>"
-        "</div>"
-    )
-
-    def _param_category(p):
-        name = p.get("name", "")
-        unit = p.get("unit", "")
-        sym = p.get("symbol", "")
-        # 几何相关：直径、长度、间距等
-        if any(k in name for k in ["直径", "长度", "间距"]) or any(
-                s in sym for s in [" d ", "\\lambda", "\\Delta"]
-        ):
-            return "几何参数"
-        # 电学相关：电压、电荷、频率等
-        if any(k in name for k in ["电压", "频率", "电荷", "电场"]) or any(
-                s in sym for s in ["U_{pp}", " f ", " Q "]
-        ):
-            return "电学参数"
-        # 无量纲 / 控制参数
-        if "无量纲" in unit or any(
-                k in name for k in ["马赫", "参数", "Mach", "耦合"]
-        ):
-            return "无量纲与控制参数"
-        # 其余（如数密度等）
-        return "其他参数"
-
     if params:
         # 按类别聚类
         grouped = {}
         for p in params:
-            cat = _param_category(p)
-            grouped.setdefault(cat, []).append(p)
+            grouped.setdefault(_param_category(p), []).append(p)
 
-        for cat_name in ["几何参数", "电学参数", "无量纲与控制参数", "其他参数"]:
-            items = grouped.get(cat_name, [])
-            if not items:
-                continue
-            html.append(
-                "<div class='param-section-header' style='margin-top:4px;'>"
-                f"<div class='param-section-title'>{cat_name}</div>"
-                "</div>"
-            )
-            html.append("<div class='param-grid'>")
-            for p in items:
-                name = p.get("name", "")
-                sym = p.get("symbol", "")
-                val = p.get("value", "")
-                unit = p.get("unit", "")
-                meaning = p.get("meaning", "")
-
-                html.append("<div class='param-card'>")
-                if sym:
-                    html.append(f"<div class='param-symbol'>{sym}</div>")
-                if val:
-                    html.append(f"<div class='param-value'>{val}</div>")
-                if unit:
-                    html.append(f"<div class='param-unit'>{unit}</div>")
-                if name:
-                    html.append(f"<div class='param-name'>{name}</div>")
-                if meaning:
-                    html.append(f"<div class='param-meaning'>{meaning}</div>")
-                html.append("</div>")
-            html.append("</div>")
+        params_html = "".join(
+            _PARAM_GROUP_TMPL.format(category=cat_name, cards="".join(map(_render_param_card, grouped[cat_name])))
+            for cat_name in _PARAM_CATEGORY_ORDER if grouped.get(cat_name)
+        )
     else:
-        html.append("<div class='param-section-sub'>未提取到参数</div>")
-    html.append("</div>")  # end param card
+        params_html = "<div class='param-section-sub'>未提取到参数</div>"
 
     # 力场 cards
-    html.append("<div class='paper-card force-section'>")
-    html.append("<h3>相互作用力场</h3>")
     if forces:
-        for f in forces:
-            name = f.get("name", "")
-            formula = f.get("formula", "").strip()
-            phys = f.get("physical_significance", "")
-            comp = f.get("computational_hint", "")
-
-            html.append("<div class='force-card'>")
-            html.append(f"<div class='force-name'>{name}</div>")
-            if formula:
-                # 保留 LaTeX，在 Markdown + KaTeX 环境下渲染
-                html.append(f"<div class='force-formula'>$$ {formula} $$</div>")
-            if phys:
-                html.append(f"<div class='force-text'>物理本质：{phys}</div>")
-            if comp:
-                html.append(f"<div class='force-text'>计算建议：{comp}</div>")
-            html.append("</div>")
+        forces_html = "".join(map(_render_force_card, forces))
     else:
-        html.append("<div class='param-section-sub'>未提取到力场</div>")
-    html.append("</div>")  # end force section
+        forces_html = "<div class='param-section-sub'>未提取到力场</div>"
+
+    return _BODY_TMPL.format(
+        env=_esc(ctx.get("environment", "N/A")),
+        background=f"<p>{_esc(bg)}</p>" if bg else "",
+        figures_html=_FIGURES_PLACEHOLDER_HTML if figures else "",
+        phenomena_html=_PHENOMENA_TMPL.format(phenomena=_esc(phenomena)) if phenomena else "",
+        params_html=params_html,
+        forces_html=forces_html,
+    )
+
 
-    html.append("</div>")  # end right
-    html.append("</div>")  # end main grid
-    html.append("</div>")  # end workbench
+# 内置示例论文是不变的常量：导入时一次性渲染好，load_demo_case 直接返回
+_DEMO_PROGRESS = render_progress_html([True] * 5)
+_DEMO_HEADER = render_header_html(DEMO_STRUCTURED_DATA)
+_DEMO_BODY = render_body_html(DEMO_STRUCTURED_DATA)
+_DEMO_FIGS = extract_figure_paths(DEMO_STRUCTURED_DATA)
 
-    return "".join(html)
+# Markdown 代码块（```json ... ``` 或 ``` ... ```）中的内容
+_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.S)
 
 
 def generate_recommendation_step(structured_data, phenomena, param_df, expert_mode=False):
@@ -889,15 +1008,15 @@ def generate_recommendation_step(structured_data, phenomena, param_df, expert_mo
     # Dataframe -> dict
     user_input_params = {"expected_phenomena": phenomena or ""}
     if isinstance(param_df, pd.DataFrame):
-        df = param_df.fillna("")
-        for _, row in df.iterrows():
-            name = str(row["参数名称"]).strip()
+        # 整表一次转换为字符串记录，避免 iterrows 为每行构造 Series
+        for row in param_df.fillna("").astype(str).to_dict(orient="records"):
+            name = row["参数名称"].strip()
             if not name:
                 continue
             user_input_params[name] = {
-                "value": str(row["目标数值"]).strip(),
-                "unit": str(row["单位"]).strip(),
-                "description": str(row["物理意义"]).strip()
+                "value": row["目标数值"].strip(),
+                "unit": row["单位"].strip(),
+                "description": row["物理意义"].strip()
             }
 
     try:
@@ -908,10 +1027,9 @@ def generate_recommendation_step(structured_data, phenomena, param_df, expert_mo
         else:
             text = str(raw_res).strip()
             # 去掉 Markdown 代码块包裹
-            if "```json" in text:
-                text = text.split("```json", 1)[1].split("```", 1)[0].strip()
-            elif "```" in text:
-                text = text.split("```", 1)[1].split("```", 1)[0].strip()
+            m = _FENCE_RE.search(text)
+            if m:
+                text = m.group(1).strip()
             parsed = safe_json_load(text)
         if not parsed:
             # return raw text
@@ -922,15 +1040,19 @@ def generate_recommendation_step(structured_data, phenomena, param_df, expert_mo
         return f"生成推荐失败: {str(e)}"
 
 
+# Simulation Setup 参数表的空白行（参数名称 / 目标数值 / 单位 / 物理意义）
+_BLANK_PARAM_ROW = ("", "", "", "")
+
+
 def add_param_row(df):
     """在 Simulation Setup 参数表中追加一行空白参数"""
     try:
         if isinstance(df, pd.DataFrame):
-            new_df = df.copy()
-            new_df.loc[len(new_df)] = ["", "", "", ""]
-            return new_df
+            # concat 一次拼接，避免 copy() 全量复制 + loc 扩展索引时逐列推断类型
+            blank = pd.DataFrame([_BLANK_PARAM_ROW], columns=df.columns)
+            return pd.concat([df, blank], ignore_index=True)
         if isinstance(df, list):
-            return df + [["", "", "", ""]]
+            return df + [list(_BLANK_PARAM_ROW)]
     except Exception as e:
         print(f"[add_param_row] 追加行失败: {e!r}")
     return df
@@ -942,8 +1064,8 @@ def remove_param_row(df):
         if isinstance(df, pd.DataFrame):
             if len(df) <= 1:
                 return df
-            new_df = df.iloc[:-1].copy()
-            return new_df
+            # Gradio 不会原地修改返回值，切片视图即可，无需 copy
+            return df.iloc[:-1]
         if isinstance(df, list):
             if len(df) <= 1:
                 return df
@@ -964,11 +1086,13 @@ def load_demo_recommendation(expert_mode=False):
 def format_number_scientific(num):
     """格式化数值，支持科学计数法的美观显示"""
     if isinstance(num, (int, float)):
+        absn = abs(num)
         # 处理科学计数法格式 (如 1.0e4, 1.5e4)
-        if abs(num) >= 1e3 or (abs(num) < 1e-2 and num != 0):
-            # 使用科学计数法
-            exp = int(f"{num:.2e}".split('e')[1])
-            base = float(f"{num:.2e}".split('e')[0])
+        if absn >= 1e3 or (absn < 1e-2 and num != 0):
+            # 使用科学计数法：只格式化一次，用 partition 拆出尾数与指数
+            mantissa, _, exp_str = f"{num:.2e}".partition('e')
+            exp = int(exp_str)
+            base = float(mantissa)
             if abs(base - 1.0) < 0.01:
                 return f"10<sup>{exp}</sup>"
             elif abs(base + 1.0) < 0.01:
@@ -983,7 +1107,7 @@ def format_number_scientific(num):
                 return str(int(num))
             else:
                 # 根据数值大小决定小数位数
-                if abs(num) >= 1:
+                if absn >= 1:
                     return f"{num:.2f}".rstrip('0').rstrip('.')
                 else:
                     return f"{num:.4f}".rstrip('0').rstrip('.')
@@ -1000,90 +1124,122 @@ def format_range_display(range_list):
     return f"[{start_str}, {end_str}]"
 
 
+# ---- 公式 / 推荐理由转 LaTeX：映射表与正则在导入时一次性编译 ----
+_FORMULA_GREEK_TRANS = str.maketrans({
+    'λ': r'\lambda', 'θ': r'\theta', 'α': r'\alpha', 'β': r'\beta',
+    'γ': r'\gamma', 'Δ': r'\Delta', 'ε': r'\epsilon', 'π': r'\pi',
+    'κ': r'\kappa', 'μ': r'\mu', 'ν': r'\nu', 'ρ': r'\rho',
+    'σ': r'\sigma', 'τ': r'\tau', 'φ': r'\phi', 'χ': r'\chi',
+    'ψ': r'\psi', 'ω': r'\omega', 'Ω': r'\Omega', 'Φ': r'\Phi',
+    'Ψ': r'\Psi', 'Σ': r'\Sigma', 'Π': r'\Pi', 'Γ': r'\Gamma',
+    'Λ': r'\Lambda', 'Ξ': r'\Xi', 'Θ': r'\Theta'
+})
+# 乘号 / 点号 / 关系符号 / Unicode 减号
+_FORMULA_SYMBOL_TRANS = str.maketrans({
+    '×': r'\times', '·': r'\cdot', '•': r'\cdot',
+    '≈': r'\approx', '∝': r'\propto', '≤': r'\leq', '≥': r'\geq',
+    '≠': r'\neq', '±': r'\pm', '∓': r'\mp', '−': '-'
+})
+_SUPERSCRIPT_MAP = {
+    '²': '^{2}', '³': '^{3}', '⁴': '^{4}', '⁵': '^{5}',
+    '⁶': '^{6}', '⁷': '^{7}', '⁸': '^{8}', '⁹': '^{9}',
+    '¹': '^{1}', '⁰': '^{0}'
+}
+# 字母、数字、右括号、右方括号、反斜杠之后紧跟的 Unicode 上标
+_SUPERSCRIPT_RE = re.compile(r'([A-Za-z0-9\)\]\\]+)([' + "".join(_SUPERSCRIPT_MAP) + '])')
+_FORMULA_SUBSCRIPT_RE = re.compile(r'([A-Za-z\\]+)_([A-Za-z0-9]+)')
+# 多个反斜杠的数学函数（\\cos 等 -> \cos），以及未转义的数学函数（cos -> \cos）
+_ESCAPED_FUNC_RE = re.compile(r'\\\\+(cos|sin|tan|exp|ln|log)')
+_UNESCAPED_FUNC_RE = re.compile(r'(?<!\\)\b(cos|sin|tan|exp|ln|log)\b')
+_WHITESPACE_RE = re.compile(r'\s+')
+# 纯 ASCII 公式中仍需改写的内容：下标、反斜杠、数学函数名；都没有时只需合并空白
+_FORMULA_ASCII_WORK_RE = re.compile(r'[_\\]|\b(?:cos|sin|tan|exp|ln|log)\b')
+# 推荐理由：幂次 / 下标 / 约等号 / 单字符符号合并为一个正则，一次扫描完成替换
+_REASON_SYMBOL_MAP = {
+    '×': r'\times', '∝': r'\propto', '≈': r'\approx',
+    'λ': r'\lambda', 'θ': r'\theta', 'κ': r'\kappa', 'Δ': r'\Delta',
+    'ε': r'\epsilon', 'π': r'\pi', 'α': r'\alpha', 'β': r'\beta', 'γ': r'\gamma'
+}
+_REASON_RE = re.compile(
+    r'(\d+)\^(\d+)'                     # 10^4
+    r'|([A-Za-z_]+)\^(\d+)'              # Q^2
+    r'|([A-Za-z_]+)_([A-Za-z0-9]+)'       # λ_D
+    r'|([A-Za-z]+)≈'                      # a≈
+    r'|([' + "".join(_REASON_SYMBOL_MAP) + '])'
+)
+
+_HTML_SPECIALS_RE = re.compile(r'[<>&"\']')
+
+
+def _reason_token(m):
+    """按命中的分支返回带 __MATH_*__ 占位符的 LaTeX 片段"""
+    i = m.lastindex
+    if i == 2:
+        body = f"{m[1]}^{{{m[2]}}}"
+    elif i == 4:
+        body = f"{m[3]}^{{{m[4]}}}"
+    elif i == 6:
+        body = f"{m[5]}_{{{m[6]}}}"
+    elif i == 7:
+        body = f"{m[7]} \\approx"
+    else:
+        body = _REASON_SYMBOL_MAP[m[8]]
+    return f"__MATH_START__{body}__MATH_END__"
+
+
+def _reason_to_latex(text):
+    """将推荐理由中的数学表达式转换为 LaTeX，并转义 HTML（先替换占位符，再转义，最后还原为 $）"""
+    s = _REASON_RE.sub(_reason_token, text)
+    # 多数推荐理由（中文段落）不含 HTML 特殊字符，此时跳过 escape 的五次整串替换
+    if _HTML_SPECIALS_RE.search(s):
+        s = html_escape.escape(s)
+    return s.replace('__MATH_START__', '$').replace('__MATH_END__', '$')
+
+
+# 力场推荐理由中的公式：函数名(参数) = 表达式（直到句号、逗号、分号或换行）
+_FORMULA_RE = re.compile(r'([A-Za-z_]+\([^)]+\))\s*=\s*([^。，；\n]+?)(?=[。，；\n]|$)')
+
+
+@functools.lru_cache(maxsize=256)
 def convert_formula_to_latex(formula_text):
-    """将力场公式文本转换为 LaTeX 格式，确保所有数学符号正确渲染"""
+    """将力场公式文本转换为 LaTeX 格式，确保所有数学符号正确渲染（纯函数，结果按输入缓存）"""
     if not formula_text:
         return ""
 
+    # 快速路径：纯 ASCII 且无下标 / 反斜杠 / 函数名（如 E = m c^2），希腊字母、上标、符号替换都不会命中
+    if formula_text.isascii() and not _FORMULA_ASCII_WORK_RE.search(formula_text):
+        return _WHITESPACE_RE.sub(' ', formula_text).strip()
+
     latex = formula_text
 
-    # 1. 先替换希腊字母（在替换其他符号之前）
-    greek_map = {
-        'λ': r'\lambda', 'θ': r'\theta', 'α': r'\alpha', 'β': r'\beta',
-        'γ': r'\gamma', 'Δ': r'\Delta', 'ε': r'\epsilon', 'π': r'\pi',
-        'κ': r'\kappa', 'μ': r'\mu', 'ν': r'\nu', 'ρ': r'\rho',
-        'σ': r'\sigma', 'τ': r'\tau', 'φ': r'\phi', 'χ': r'\chi',
-        'ψ': r'\psi', 'ω': r'\omega', 'Ω': r'\Omega', 'Φ': r'\Phi',
-        'Ψ': r'\Psi', 'Σ': r'\Sigma', 'Π': r'\Pi', 'Γ': r'\Gamma',
-        'Λ': r'\Lambda', 'Ξ': r'\Xi', 'Θ': r'\Theta'
-    }
-    for greek, latex_cmd in greek_map.items():
-        latex = latex.replace(greek, latex_cmd)
-
-    # 2. 处理上标（Unicode 上标字符）
-    superscript_map = {
-        '²': '^{2}', '³': '^{3}', '⁴': '^{4}', '⁵': '^{5}',
-        '⁶': '^{6}', '⁷': '^{7}', '⁸': '^{8}', '⁹': '^{9}',
-        '¹': '^{1}', '⁰': '^{0}'
-    }
-    for sup, replacement in superscript_map.items():
-        # 匹配字母、数字、右括号、右方括号后的上标
-        latex = re.sub(r'([A-Za-z0-9\)\]\\]+)' + re.escape(sup), r'\1' + replacement, latex)
+    # 1. 先替换希腊字母（在替换其他符号之前），str.translate 一次扫描完成
+    latex = latex.translate(_FORMULA_GREEK_TRANS)
+
+    # 2. 处理上标（Unicode 上标字符），所有上标一次扫描完成
+    latex = _SUPERSCRIPT_RE.sub(lambda m: m.group(1) + _SUPERSCRIPT_MAP[m.group(2)], latex)
 
     # 3. 处理下标（在希腊字母替换之后）
     # 匹配 \命令_ 或 字母_ 的模式
-    latex = re.sub(r'([A-Za-z\\]+)_([A-Za-z0-9]+)', r'\1_{\2}', latex)
+    latex = _FORMULA_SUBSCRIPT_RE.sub(r'\1_{\2}', latex)
 
     # 4. 处理数学函数
     # 先处理多个反斜杠的情况（\\\\cos, \\\\cos 等 -> \cos）
-    latex = re.sub(r'\\\\+cos', r'\\cos', latex)
-    latex = re.sub(r'\\\\+sin', r'\\sin', latex)
-    latex = re.sub(r'\\\\+tan', r'\\tan', latex)
-    latex = re.sub(r'\\\\+exp', r'\\exp', latex)
-    latex = re.sub(r'\\\\+ln', r'\\ln', latex)
-    latex = re.sub(r'\\\\+log', r'\\log', latex)
-
+    latex = _ESCAPED_FUNC_RE.sub(r'\\\1', latex)
     # 处理未转义的函数（cos -> \cos），但避免替换已经在反斜杠后的
-    math_functions_unescaped = {
-        r'(?<!\\)\bcos\b': r'\\cos',
-        r'(?<!\\)\bsin\b': r'\\sin',
-        r'(?<!\\)\btan\b': r'\\tan',
-        r'(?<!\\)\bexp\b': r'\\exp',
-        r'(?<!\\)\bln\b': r'\\ln',
-        r'(?<!\\)\blog\b': r'\\log',
-    }
-    for pattern, replacement in math_functions_unescaped.items():
-        latex = re.sub(pattern, replacement, latex)
+    latex = _UNESCAPED_FUNC_RE.sub(r'\\\1', latex)
 
     # 5. 处理分数：a/b -> \frac{a}{b}（但保持简单分数如 r/λ 不变，除非是复杂分数）
     # 这里保持 / 格式，因为更简洁，MathJax 会自动处理
+    # 6. 指数表达式 e^{-r/λ} 保持原样（希腊字母已在第 1 步转换）
 
-    # 6. 处理指数表达式：e^{-r/λ} 或 e^{-r/\lambda}
-    # 确保指数中的分数正确
-    latex = re.sub(r'e\^\{([^}]+)\}', r'e^{\1}', latex)
-
-    # 7. 处理乘号和点号
-    latex = latex.replace('×', r'\times')
-    latex = latex.replace('·', r'\cdot')
-    latex = latex.replace('•', r'\cdot')
-
-    # 8. 处理关系符号
-    latex = latex.replace('≈', r'\approx')
-    latex = latex.replace('∝', r'\propto')
-    latex = latex.replace('≤', r'\leq')
-    latex = latex.replace('≥', r'\geq')
-    latex = latex.replace('≠', r'\neq')
-    latex = latex.replace('±', r'\pm')
-    latex = latex.replace('∓', r'\mp')
-
-    # 9. 处理减号和负号
-    latex = latex.replace('−', '-')  # Unicode 减号转为 ASCII 减号
+    # 7-9. 处理乘号、点号、关系符号，以及 Unicode 减号转为 ASCII 减号（一次 translate）
+    latex = latex.translate(_FORMULA_SYMBOL_TRANS)
 
     # 10. 处理括号和分隔符
     # 确保括号匹配，但保持原样（LaTeX 会自动处理）
 
     # 11. 处理空格（LaTeX 中多个空格会被合并，但保留必要的空格）
-    latex = re.sub(r'\s+', ' ', latex)  # 多个空格合并为一个
+    latex = _WHITESPACE_RE.sub(' ', latex)  # 多个空格合并为一个
 
     # 12. 清理多余的转义（如果有）
     latex = latex.strip()
@@ -1091,10 +1247,19 @@ def convert_formula_to_latex(formula_text):
     return latex
 
 
+# 元素文本内容只需转义 & < >（引号只在属性值里有意义）
+_HTML_TEXT_TRANS = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def _expert_json_html(res_json):
+    """专家模式下展示的原始 JSON：缩进 2 格并做 HTML 转义；装有 orjson 时用它序列化"""
+    return _dumps_pretty(res_json).translate(_HTML_TEXT_TRANS)
+
+
 def format_recommendation_panel(res_json, expert_mode=False):
     """渲染推荐报告，包含格式化的参数表格和 LaTeX 力场公式"""
-    html = card_css()
-    html += """
+    # 全局卡片样式已由界面中的 gr.HTML(card_css()) 注入一次，这里只附加表格专用样式
+    parts = ["""
     <style>
       .param-table { width:100%; border-collapse:collapse; margin:12px 0; }
       .param-table th { background:#f8fafc; padding:12px; text-align:left; border-bottom:2px solid #e2e8f0; font-weight:600; font-size:0.9rem; }
@@ -1123,16 +1288,20 @@ def format_recommendation_panel(res_json, expert_mode=False):
         }
       };
     </script>
-    """
+    """]
 
-    html += "<div class='card'><h3>🚀 物理对标模拟推荐</h3>"
-    html += "<div class='muted' style='margin-bottom:16px;'>请在使用前检查单位与数值的量纲一致性。</div>"
+    parts.extend([
+        "<div class='card'><h3>🚀 物理对标模拟推荐</h3>",
+        "<div class='muted' style='margin-bottom:16px;'>请在使用前检查单位与数值的量纲一致性。</div>",
+    ])
 
     # Parameter recommendations table
-    html += "<h4 style='margin-top:20px; margin-bottom:12px;'>📊 推荐参数区间</h4>"
-    html += "<table class='param-table'>"
-    html += "<thead><tr><th style='width:18%'>参数名称</th><th style='width:20%'>数值范围</th><th style='width:12%'>步长</th><th style='width:10%'>单位</th><th style='width:40%'>推荐理由</th></tr></thead>"
-    html += "<tbody>"
+    parts.extend([
+        "<h4 style='margin-top:20px; margin-bottom:12px;'>📊 推荐参数区间</h4>",
+        "<table class='param-table'>",
+        "<thead><tr><th style='width:18%'>参数名称</th><th style='width:20%'>数值范围</th><th style='width:12%'>步长</th><th style='width:10%'>单位</th><th style='width:40%'>推荐理由</th></tr></thead>",
+        "<tbody>",
+    ])
 
     for p_name, info in res_json.get("parameter_recommendations", {}).items():
         r = info.get("range", ["N/A", "N/A"])
@@ -1149,35 +1318,10 @@ def format_recommendation_panel(res_json, expert_mode=False):
         else:
             step_str = str(step)
 
-        # 处理推荐理由中的数学表达式，转换为 LaTeX
-        # 重要：先转换数学符号，再转义 HTML，避免 $ 被转义
-        reason_processed = reason
-
-        # 先转换数学符号为 LaTeX（在转义之前）
-        reason_processed = re.sub(r'(\d+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', reason_processed)  # 10^4
-        reason_processed = re.sub(r'([A-Za-z_]+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', reason_processed)  # Q^2
-        reason_processed = re.sub(r'([A-Za-z_]+)_([A-Za-z0-9]+)', r'__MATH_START__\1_{\2}__MATH_END__',
-                                  reason_processed)  # λ_D
-        reason_processed = re.sub(r'([A-Za-z]+)≈', r'__MATH_START__\1 \\approx__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'∝', r'__MATH_START__\\propto__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'×', r'__MATH_START__\\times__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'λ', r'__MATH_START__\\lambda__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'θ', r'__MATH_START__\\theta__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'κ', r'__MATH_START__\\kappa__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'Δ', r'__MATH_START__\\Delta__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'ε', r'__MATH_START__\\epsilon__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'π', r'__MATH_START__\\pi__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'α', r'__MATH_START__\\alpha__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'β', r'__MATH_START__\\beta__MATH_END__', reason_processed)
-        reason_processed = re.sub(r'γ', r'__MATH_START__\\gamma__MATH_END__', reason_processed)
-
-        # 转义 HTML 特殊字符（但保留数学标记）
-        reason_processed = html_escape.escape(reason_processed)
-
-        # 将数学标记替换为 LaTeX 格式
-        reason_processed = reason_processed.replace('__MATH_START__', '$').replace('__MATH_END__', '$')
-
-        html += f"""
+        # 处理推荐理由中的数学表达式，转换为 LaTeX（先转换数学符号，再转义 HTML，避免 $ 被转义）
+        reason_processed = _reason_to_latex(str(reason))
+
+        parts.append(f"""
         <tr>
             <td class='param-name'>{p_name}</td>
             <td class='param-range'>{range_str}</td>
@@ -1185,24 +1329,24 @@ def format_recommendation_panel(res_json, expert_mode=False):
             <td class='param-unit'>{unit}</td>
             <td class='param-reason'>{reason_processed}</td>
         </tr>
-        """
+        """)
 
-    html += "</tbody></table>"
+    parts.append("</tbody></table>")
 
     # Force field recommendation with LaTeX rendering
     ff = res_json.get("force_field_recommendation", {})
-    html += "<hr style='margin:24px 0; border-color:#e2e8f0;'/>"
-    html += "<h4 style='margin-top:20px; margin-bottom:12px;'>🧪 推荐模拟力场模型</h4>"
+    parts.extend([
+        "<hr style='margin:24px 0; border-color:#e2e8f0;'/>",
+        "<h4 style='margin-top:20px; margin-bottom:12px;'>🧪 推荐模拟力场模型</h4>",
+    ])
 
     reason_text = ff.get('reason', '')
     force_name = ff.get('name', 'N/A')
 
-    html += f"<div class='force-field-name'>{force_name}</div>"
+    parts.append(f"<div class='force-field-name'>{force_name}</div>")
 
-    # 提取力场公式（查找形如 W(r,θ) = ... 的公式）
-    # 匹配模式：函数名(参数) = 表达式（直到句号、逗号、分号或换行）
-    formula_pattern = r'([A-Za-z_]+\([^)]+\))\s*=\s*([^。，；\n]+?)(?=[。，；\n]|$)'
-    formula_match = re.search(formula_pattern, reason_text)
+    # 提取力场公式（查找形如 W(r,θ) = ... 的公式，见 _FORMULA_RE）
+    formula_match = _FORMULA_RE.search(reason_text)
 
     if formula_match:
         formula_name = formula_match.group(1)  # W(r,θ)
@@ -1213,63 +1357,73 @@ def format_recommendation_panel(res_json, expert_mode=False):
 
         # 修复双反斜杠问题（如 \\cos -> \cos）
         # 使用正则表达式处理多个反斜杠的情况
-        formula_latex = re.sub(r'\\\\+cos', r'\\cos', formula_latex)
-        formula_latex = re.sub(r'\\\\+sin', r'\\sin', formula_latex)
-        formula_latex = re.sub(r'\\\\+tan', r'\\tan', formula_latex)
-        formula_latex = re.sub(r'\\\\+exp', r'\\exp', formula_latex)
-        formula_latex = re.sub(r'\\\\+ln', r'\\ln', formula_latex)
-        formula_latex = re.sub(r'\\\\+log', r'\\log', formula_latex)
+        formula_latex = _ESCAPED_FUNC_RE.sub(r'\\\1', formula_latex)
 
         # 使用 \\[ \\] 块级公式格式，交由 Gradio Markdown 的 KaTeX 渲染
-        html += f"""
+        parts.append(f"""
         <div class='latex-container'>
             <div style='font-size:1.0rem; margin-bottom:12px; color:#475569; font-weight:500;'>力场公式：</div>
             <div class='latex-formula' style='font-size:1.2rem; text-align:center; padding:12px;'>\\[{formula_latex}\\]</div>
         </div>
-        """
-
-    # 处理推荐理由文本，转换数学表达式为 LaTeX
-    # 使用占位符方法避免 HTML 转义影响 LaTeX
-    reason_with_latex = reason_text
-
-    # 先转换数学符号为占位符
-    reason_with_latex = re.sub(r'(\d+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'([A-Za-z_]+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'([A-Za-z_]+)_([A-Za-z0-9]+)', r'__MATH_START__\1_{\2}__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'([A-Za-z]+)≈', r'__MATH_START__\1 \\approx__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'∝', r'__MATH_START__\\propto__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'×', r'__MATH_START__\\times__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'λ', r'__MATH_START__\\lambda__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'θ', r'__MATH_START__\\theta__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'κ', r'__MATH_START__\\kappa__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'Δ', r'__MATH_START__\\Delta__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'ε', r'__MATH_START__\\epsilon__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'π', r'__MATH_START__\\pi__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'α', r'__MATH_START__\\alpha__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'β', r'__MATH_START__\\beta__MATH_END__', reason_with_latex)
-    reason_with_latex = re.sub(r'γ', r'__MATH_START__\\gamma__MATH_END__', reason_with_latex)
-
-    # 转义 HTML 特殊字符
-    reason_with_latex = html_escape.escape(reason_with_latex)
-
-    # 将占位符替换为 LaTeX 格式
-    reason_with_latex = reason_with_latex.replace('__MATH_START__', '$').replace('__MATH_END__', '$')
-
-    html += f"<div class='force-field-reason'>{reason_with_latex}</div>"
+        """)
+
+    # 处理推荐理由文本，转换数学表达式为 LaTeX（使用占位符方法避免 HTML 转义影响 LaTeX）
+    reason_with_latex = _reason_to_latex(str(reason_text))
+
+    parts.append(f"<div class='force-field-reason'>{reason_with_latex}</div>")
 
     # Expert details
     if expert_mode:
-        html += "<hr style='margin:24px 0; border-color:#e2e8f0;'/>"
-        html += "<h4 style='margin-top:20px; margin-bottom:12px;'>🔎 Expert Details (原始 JSON)</h4>"
-        html += "<pre style='font-size:0.85rem; background:#f8fafc; padding:16px; border-radius:8px; overflow:auto; max-height:300px; border:1px solid #e2e8f0;'>"
-        html += html_escape.escape(json.dumps(res_json, indent=2, ensure_ascii=False))
-        html += "</pre>"
+        parts.extend([
+            "<hr style='margin:24px 0; border-color:#e2e8f0;'/>",
+            "<h4 style='margin-top:20px; margin-bottom:12px;'>🔎 Expert Details (原始 JSON)</h4>",
+            "<pre style='font-size:0.85rem; background:#f8fafc; padding:16px; border-radius:8px; overflow:auto; max-height:300px; border:1px solid #e2e8f0;'>",
+            _expert_json_html(res_json),
+            "</pre>",
+        ])
+
+    parts.append("</div>")
+    return "".join(parts)
 
-    html += "</div>"
-    return html
+
+# 推荐报告渲染缓存：键为 (规范化 JSON 的 blake2b 摘要, expert_mode)，
+# 同一份推荐结果反复渲染（示例模式、切换专家模式、界面重绘）时直接复用，按最近使用淘汰
+_RECO_CACHE_SIZE = 128
+_reco_cache = {}  # (digest, expert_mode) -> html
+_reco_cache_lock = threading.Lock()
 
 
 def format_recommendation_panel_v2(res_json, expert_mode=False):
+    """
+    新版推荐报告渲染：参数卡片 + 力场卡片仪表盘（带缓存）。
+    """
+    try:
+        canonical = json.dumps(res_json, sort_keys=True, ensure_ascii=False, default=dict)
+    except (TypeError, ValueError):
+        # 无法规范化（如键类型混杂）时不缓存，直接渲染
+        return _render_recommendation_panel_v2(res_json, expert_mode)
+    key = (hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest(), bool(expert_mode))
+    with _reco_cache_lock:
+        html = _reco_cache.pop(key, None)
+        if html is not None:
+            _reco_cache[key] = html  # 重新插入到末尾，标记为最近使用
+            return html
+
+    html = _render_recommendation_panel_v2(res_json, expert_mode)
+    with _reco_cache_lock:
+        if len(_reco_cache) >= _RECO_CACHE_SIZE:
+            _reco_cache.pop(next(iter(_reco_cache)))
+        _reco_cache[key] = html
+    return html
+
+
+def clear_recommendation_cache():
+    """清空推荐报告渲染缓存（开发调试修改渲染逻辑后调用）"""
+    with _reco_cache_lock:
+        _reco_cache.clear()
+
+
+def _render_recommendation_panel_v2(res_json, expert_mode=False):
     """
     新版推荐报告渲染：参数卡片 + 力场卡片仪表盘。
     """
@@ -1282,8 +1436,7 @@ def format_recommendation_panel_v2(res_json, expert_mode=False):
             return "0"
         absn = abs(num)
         if absn >= 1e3 or (absn < 1e-2):
-            s = f"{num:.4e}"
-            base_str, exp_str = s.split("e")
+            base_str, _, exp_str = f"{num:.4e}".partition("e")
             exp = int(exp_str)
             base = float(base_str)
             if abs(base - 1.0) < 1e-8:
@@ -1310,33 +1463,10 @@ def format_recommendation_panel_v2(res_json, expert_mode=False):
         """将推荐理由中的常见数学模式转成 LaTeX，同时转义 HTML。"""
         if not text:
             return ""
-        s = str(text)
-        # 典型幂次 / 下标
-        s = re.sub(r'(\d+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', s)
-        s = re.sub(r'([A-Za-z_]+)\^(\d+)', r'__MATH_START__\1^{\2}__MATH_END__', s)
-        s = re.sub(r'([A-Za-z_]+)_([A-Za-z0-9]+)', r'__MATH_START__\1_{\2}__MATH_END__', s)
-        s = s.replace("×", "__MATH_START__\\times__MATH_END__")
-        # 常见希腊字母符号
-        greek_map = {
-            "λ": "\\lambda",
-            "θ": "\\theta",
-            "κ": "\\kappa",
-            "Δ": "\\Delta",
-            "ε": "\\epsilon",
-            "π": "\\pi",
-            "α": "\\alpha",
-            "β": "\\beta",
-            "γ": "\\gamma",
-        }
-        for ch, cmd in greek_map.items():
-            s = s.replace(ch, f"__MATH_START__{cmd}__MATH_END__")
-        # 先转义 HTML，再恢复数学占位符为 $...$
-        s = html_escape.escape(s)
-        s = s.replace("__MATH_START__", "$").replace("__MATH_END__", "$")
-        return s
+        return _reason_to_latex(str(text))
 
     # --- 布局容器（CSS 已在 card_css 中全局注入） ---
-    html = "<div class='recom-wrapper'>"
+    parts = ["<div class='recom-wrapper'>"]
 
     # --- 参数推荐卡片 ---
     for p_name, info in res_json.get("parameter_recommendations", {}).items():
@@ -1379,7 +1509,7 @@ def format_recommendation_panel_v2(res_json, expert_mode=False):
             f"  <div class=\"reason-box\">{reason_html}</div>",
             "</div>",
         ]
-        html += "\n".join(card_lines)
+        parts.append("\n".join(card_lines))
 
     # --- 推荐力场模型卡片 ---
     ff = res_json.get("force_field_recommendation", {})
@@ -1394,58 +1524,167 @@ def format_recommendation_panel_v2(res_json, expert_mode=False):
         f"  <div class=\"recom-force-body\">{reason_html}</div>",
         "</div>",
     ]
-    html += "\n" + "\n".join(force_lines)
+    parts.append("\n" + "\n".join(force_lines))
 
     # 可选：附加 Expert JSON
     if expert_mode:
-        expert_json = html_escape.escape(json.dumps(res_json, indent=2, ensure_ascii=False))
-        html += f"<div class='recom-expert-json'>{expert_json}</div>"
+        parts.append(f"<div class='recom-expert-json'>{_expert_json_html(res_json)}</div>")
 
-    html += "</div>"
-    return html
+    parts.append("</div>")
+    return "".join(parts)
 
 
 # ---- Library functions ----
-def list_indexed_papers():
-    """读取 SQLite，返回表格（title, year, journal, id）"""
-    db = rag_system.db_path
+_LIBRARY_COLUMNS = ["id", "title", "journal", "year"]
+_LIB_ID_COL = _LIBRARY_COLUMNS.index("id")  # id 列位置固定，选中行时按位置取值
+LIBRARY_PAGE_SIZE = 200  # Library 表格每页显示的论文数
+# 由 SQLite JSON1 直接提取 journal / year，无需把整段 metadata_json 取回 Python 解析；
+# CASE 保证只对合法 JSON 调用 json_extract（否则整条查询会报 malformed JSON）
+_SQL_LIST_PAPERS = """
+SELECT id, title,
+       CASE WHEN json_valid(metadata_json)
+            THEN COALESCE(json_extract(metadata_json, '$.metadata.journal'), '') ELSE '' END,
+       CASE WHEN json_valid(metadata_json)
+            THEN COALESCE(json_extract(metadata_json, '$.metadata.year'), '') ELSE '' END
+FROM papers WHERE {where} ORDER BY id DESC LIMIT :limit OFFSET :offset
+"""
+# 标题搜索条件：关键词为空时不过滤（title 为 NULL 的论文也保留）
+_SQL_LIBRARY_FILTER = "(:q = '' OR title LIKE :pattern ESCAPE '\\')"
+_SQL_LIST_PAPERS = _SQL_LIST_PAPERS.format(where=_SQL_LIBRARY_FILTER)
+
+
+def _library_query_params(q):
+    """标题搜索参数：转义 LIKE 通配符后做子串匹配（SQLite 的 LIKE 对 ASCII 不区分大小写）"""
+    q = (q or "").strip()
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return {"q": q, "pattern": f"%{escaped}%"}
+
+
+def _iter_library_rows_py(cur, params):
+    """不支持 JSON1 时的回退：逐行在 Python 侧解析 metadata_json"""
+    cur.execute("SELECT id, title, metadata_json FROM papers WHERE " + _SQL_LIBRARY_FILTER +
+                " ORDER BY id DESC LIMIT :limit OFFSET :offset", params)
+    for rid, title, meta in cur:
+        try:
+            md = _loads(meta) if meta else {}
+        except (ValueError, TypeError):
+            md = {}
+        info = (md or {}).get("metadata", {})
+        yield rid, title, info.get("journal", ""), info.get("year", "")
+
+
+def _library_fingerprint():
+    """知识库文件指纹：主库与 WAL 文件的 (mtime_ns, size)。WAL 模式下写入先落在 -wal 文件，两者都要看"""
+    fp = []
+    for path in (rag_system.db_path, rag_system.db_path + "-wal"):
+        try:
+            st = os.stat(path)
+            fp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            fp.append(None)
+        except OSError:
+            return None
+    return tuple(fp)
+
+
+# 论文列表页 / 总数缓存：以知识库文件指纹为键，未变化时切换到 Library 不再访问数据库；
+# 新论文入库时由 clear_library_cache 显式失效（同一秒内多次写入时 mtime 可能分辨不出）
+_LIB_CACHE = {"key": None, "df": None, "generation": 0}
+_LIB_COUNT_CACHE = {"key": None, "n": 0}
+
+
+def clear_library_cache():
+    """使论文列表及论文详情缓存失效（有新论文入库时调用）"""
+    _LIB_CACHE["key"] = None
+    _LIB_CACHE["generation"] += 1
+    _LIB_COUNT_CACHE["key"] = None
+    _load_paper_bundle.cache_clear()
+
+
+def library_version(q=""):
+    """当前论文列表的版本标识 (文件指纹, 失效代数, 关键词)：不变时界面上已显示的表格仍然有效"""
+    return _library_fingerprint(), _LIB_CACHE["generation"], (q or "").strip()
+
+
+def count_indexed_papers(q=""):
+    """已入库论文总数（用于 Library 分页）；q 非空时只统计标题匹配的论文"""
+    fp = _library_fingerprint()
+    params = _library_query_params(q)
+    key = (fp, params["q"])
+    if fp is not None and key == _LIB_COUNT_CACHE["key"]:
+        return _LIB_COUNT_CACHE["n"]
     try:
-        with sqlite3.connect(db) as conn:
+        with db_connection() as conn:
+            n = conn.execute("SELECT COUNT(*) FROM papers WHERE " + _SQL_LIBRARY_FILTER, params).fetchone()[0]
+    except Exception:
+        return 0
+    _LIB_COUNT_CACHE["key"], _LIB_COUNT_CACHE["n"] = key, n
+    return n
+
+
+def list_indexed_papers(limit=LIBRARY_PAGE_SIZE, offset=0, q=""):
+    """读取 SQLite，返回一页表格（id, title, journal, year），按 id 倒序；标题过滤与分页都在 SQL 中完成"""
+    fp = _library_fingerprint()
+    params = dict(_library_query_params(q), limit=limit, offset=offset)
+    key = (fp, limit, offset, params["q"])
+    if fp is not None and key == _LIB_CACHE["key"]:
+        return _LIB_CACHE["df"]
+    try:
+        with db_connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id, title, metadata_json FROM papers ORDER BY id DESC")
-            rows = cur.fetchall()
-            items = []
-            for rid, title, meta in rows:
-                md = safe_json_load(meta) or {}
-                year = md.get("metadata", {}).get("year", "")
-                journal = md.get("metadata", {}).get("journal", "")
-                items.append([rid, title, journal, year])
-            df = pd.DataFrame(items, columns=["id", "title", "journal", "year"])
+            cur.arraysize = 1000
+            try:
+                cur.execute(_SQL_LIST_PAPERS, params)
+                rows = cur
+            except sqlite3.OperationalError:
+                rows = _iter_library_rows_py(cur, params)
+            df = pd.DataFrame.from_records(rows, columns=_LIBRARY_COLUMNS)
+            _LIB_CACHE["key"], _LIB_CACHE["df"] = key, df
             return df
     except Exception as e:
-        return pd.DataFrame([], columns=["id", "title", "journal", "year"])
+        if DEBUG:
+            print(f"[list_indexed_papers] 读取论文列表失败: {e!r}")
+        return pd.DataFrame([], columns=_LIBRARY_COLUMNS)
 
 
 def view_paper_metadata(paper_id):
-    """点击 library 的某篇，显示 metadata card"""
+    """点击 library 的某篇，显示 metadata card；返回 (html, 解析后的数据, 格式化 JSON)，出错时后两项为 None 和空串"""
     try:
-        with sqlite3.connect(rag_system.db_path) as conn:
+        with db_connection() as conn:
             cur = conn.cursor()
             cur.execute("SELECT metadata_json FROM papers WHERE id = ?", (int(paper_id),))
             r = cur.fetchone()
             if not r:
-                return "找不到该论文", ""
+                return "找不到该论文", None, ""
             meta = safe_json_load(r[0]) or {}
             # Library 中仍使用完整卡片视图展示（沿用 body + header 的组合）
             header_html = render_header_html(meta)
             body_html = render_body_html(meta)
             html = header_html + body_html
-            return html, json.dumps(meta, indent=2, ensure_ascii=False)
+            return html, meta, _dumps_pretty(meta)
     except Exception as e:
-        return f"读取出错: {e}", ""
+        return f"读取出错: {e}", None, ""
+
+
+@functools.lru_cache(maxsize=128)
+def _load_paper_bundle(paper_id):
+    """
+    Library 中查看论文所需的全部内容：(html, json_str, 图片 (路径, 说明) 元组)。
+    按 paper_id 缓存；读取失败时抛出 LookupError，避免把错误结果缓存下来。
+    """
+    html, data, json_str = view_paper_metadata(paper_id)
+    if data is None:
+        raise LookupError(html)
+    # 直接使用已解析的数据提取图片，不再重新解析 json_str
+    fig_paths = tuple(tuple(item) for item in extract_figure_paths(data))
+    return html, json_str, fig_paths
 
 
 # ---- Build UI ----
+# 图片目录注册为静态路径：Gallery 直接按 URL 提供文件，不再复制到 Gradio 缓存目录，也不逐请求做权限检查
+# （在模块级调用，app.py 直接复用 demo 时同样生效）
+gr.set_static_paths(paths=[os.path.join(BASE_DIR_STR, "images"), os.path.join(BASE_DIR_STR, "figures")])
+
 with gr.Blocks(
         title="PlasmaRAG"
 ) as demo:
@@ -1463,7 +1702,7 @@ with gr.Blocks(
     def get_sys_stats():
         # small stats: count papers, force fields
         try:
-            with sqlite3.connect(rag_system.db_path) as conn:
+            with db_connection() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT COUNT(*) FROM papers")
                 n_papers = cur.fetchone()[0]
@@ -1495,83 +1734,96 @@ with gr.Blocks(
         # Main workspace
         with gr.Column(scale=3):
             # Paper Analysis view
-            paper_header_html = gr.Markdown(
-                "<div class='muted'>解析结果将在此处显示</div>",
-                visible=True,
-                latex_delimiters=[
-                    {"left": "$", "right": "$", "display": False},
-                    {"left": "$$", "right": "$$", "display": True},
-                    {"left": r"\[", "right": r"\]", "display": True},
-                ],
-            )
-            # Scientific Figures Gallery（紧跟标题下方）
-            fig_gallery = gr.Gallery(
-                label="Scientific Figures",
-                show_label=False,
-                value=[],
-                columns=[3],
-                rows=[1],
-                object_fit="contain",
-                height=380,
-                visible=True,
-            )
-            # 详细内容（物理背景 + 参数 + 力场）
-            paper_body_html = gr.Markdown(
-                "",
-                visible=True,
-                latex_delimiters=[
-                    {"left": "$", "right": "$", "display": False},
-                    {"left": "$$", "right": "$$", "display": True},
-                    {"left": r"\[", "right": r"\]", "display": True},
-                ],
-            )
-            raw_structured_state = gr.State({})
+            with gr.Column(visible=True) as paper_view:
+                paper_header_html = gr.Markdown(
+                    "<div class='muted'>解析结果将在此处显示</div>",
+                    latex_delimiters=[
+                        {"left": "$", "right": "$", "display": False},
+                        {"left": "$$", "right": "$$", "display": True},
+                        {"left": r"\[", "right": r"\]", "display": True},
+                    ],
+                )
+                # Scientific Figures Gallery（紧跟标题下方）
+                fig_gallery = gr.Gallery(
+                    label="Scientific Figures",
+                    show_label=False,
+                    value=[],
+                    columns=[3],
+                    rows=[1],
+                    object_fit="contain",
+                    height=380,
+                )
+                # 详细内容（物理背景 + 参数 + 力场）
+                paper_body_html = gr.Markdown(
+                    "",
+                    latex_delimiters=[
+                        {"left": "$", "right": "$", "display": False},
+                        {"left": "$$", "right": "$$", "display": True},
+                        {"left": r"\[", "right": r"\]", "display": True},
+                    ],
+                )
+                raw_structured_state = gr.State({})
 
             # Simulation Setup view
-            sim_setup_md = gr.Markdown("### Simulation Setup", visible=False)
-            phenomena_input = gr.Textbox(label="期望观察到的物理现象", value="观察到微粒在微重力流场中形成的链状结构",
-                                         lines=3, visible=False)
-            default_params = [
-                ["target_particle_charge", "1.2 * 10^4", "e", "目标微粒电荷"],
-                ["time_scale", "200.0", "ms", "总演化时长"],
-                ["debye_length_target", "0.6", "mm", "系统德拜屏蔽长度"],
-            ]
-            with gr.Row():
-                param_df = gr.Dataframe(
-                    headers=["参数名称", "目标数值", "单位", "物理意义"],
-                    value=default_params,
-                    row_count="dynamic",
-                    column_count=(4, "fixed"),
-                    datatype=["str", "str", "str", "str"],
-                    label="用户模拟参数表 (可增减行)",
-                    visible=False,
+            with gr.Column(visible=False) as sim_view:
+                sim_setup_md = gr.Markdown("### Simulation Setup")
+                phenomena_input = gr.Textbox(label="期望观察到的物理现象", value="观察到微粒在微重力流场中形成的链状结构",
+                                             lines=3)
+                default_params = [
+                    ["target_particle_charge", "1.2 * 10^4", "e", "目标微粒电荷"],
+                    ["time_scale", "200.0", "ms", "总演化时长"],
+                    ["debye_length_target", "0.6", "mm", "系统德拜屏蔽长度"],
+                ]
+                with gr.Row():
+                    param_df = gr.Dataframe(
+                        headers=["参数名称", "目标数值", "单位", "物理意义"],
+                        value=default_params,
+                        row_count="dynamic",
+                        column_count=(4, "fixed"),
+                        datatype=["str", "str", "str", "str"],
+                        label="用户模拟参数表 (可增减行)",
+                    )
+                    with gr.Column(scale=0.1):
+                        add_param_row_btn = gr.Button("➕", variant="secondary",
+                                                      elem_classes=["param-row-btn"])
+                        remove_param_row_btn = gr.Button("➖", variant="secondary",
+                                                         elem_classes=["param-row-btn"])
+                recom_btn = gr.Button("💡 生成对标推荐报告", variant="primary")
+                demo_recom_btn = gr.Button("🧪 加载示例推荐（渲染测试）", variant="secondary")
+                recom_panel = gr.Markdown(
+                    "<div class='muted'>推荐结果将在此处显示</div>",
+                    latex_delimiters=[
+                        {"left": "$", "right": "$", "display": False},
+                        {"left": "$$", "right": "$$", "display": True},
+                        {"left": r"\[", "right": r"\]", "display": True},
+                    ],
                 )
-                with gr.Column(scale=0.1):
-                    add_param_row_btn = gr.Button("➕", variant="secondary", visible=False,
-                                                  elem_classes=["param-row-btn"])
-                    remove_param_row_btn = gr.Button("➖", variant="secondary", visible=False,
-                                                     elem_classes=["param-row-btn"])
-            recom_btn = gr.Button("💡 生成对标推荐报告", variant="primary", visible=False)
-            demo_recom_btn = gr.Button("🧪 加载示例推荐（渲染测试）", variant="secondary", visible=False)
-            recom_panel = gr.Markdown(
-                "<div class='muted'>推荐结果将在此处显示</div>",
-                visible=False,
-                latex_delimiters=[
-                    {"left": "$", "right": "$", "display": False},
-                    {"left": "$$", "right": "$$", "display": True},
-                    {"left": r"\[", "right": r"\]", "display": True},
-                ],
-            )
 
             # Library view
-            lib_md = gr.Markdown("### Indexed Papers", visible=False)
-            lib_table = gr.Dataframe(value=list_indexed_papers(), interactive=False, label="已入库论文", visible=False)
-            lib_view_btn = gr.Button("📖 查看选中论文", visible=False)
-            lib_details_html = gr.HTML("<div class='muted'>论文元数据 / 阅读器</div>", visible=False)
-            # State for storing paper metadata JSON
-            lib_metadata_state = gr.State("")
-            # State: 当前在 Library 里用户选中的论文 ID
-            lib_selected_id = gr.State(None)
+            with gr.Column(visible=False) as lib_view:
+                lib_md = gr.Markdown("### Indexed Papers")
+                lib_search = gr.Textbox(placeholder="按标题搜索，回车确认", show_label=False)
+                # 初始为空表：Library 视图默认隐藏，进入时由 switch_view 按页加载
+                # 列类型显式固定为 number / str（不使用 date 类型，year 也按字符串显示）
+                lib_table = gr.Dataframe(value=pd.DataFrame([], columns=_LIBRARY_COLUMNS), interactive=False,
+                                         datatype=["number", "str", "str", "str"], label="已入库论文")
+                with gr.Row():
+                    lib_prev_btn = gr.Button("⬅️ 上一页", size="sm")
+                    lib_page_md = gr.Markdown("")
+                    lib_next_btn = gr.Button("下一页 ➡️", size="sm")
+                    lib_refresh_btn = gr.Button("🔄 刷新", size="sm")
+                # State: Library 当前页码（从 0 开始）
+                lib_page = gr.State(0)
+                # State: 表格当前内容对应的 library_version()，重新进入 Library 时据此判断是否需要重新推送
+                lib_loaded_version = gr.State(None)
+                # State: 当前页各行的论文 ID（按行号对应），选中行时据此查找，不依赖进程级缓存
+                lib_page_ids = gr.State([])
+                lib_view_btn = gr.Button("📖 查看选中论文")
+                lib_details_html = gr.HTML("<div class='muted'>论文元数据 / 阅读器</div>")
+                # State for storing paper metadata JSON
+                lib_metadata_state = gr.State("")
+                # State: 当前在 Library 里用户选中的论文 ID
+                lib_selected_id = gr.State(None)
 
     # Bind events
     parse_btn.click(fn=process_pdf_step, inputs=[upload],
@@ -1590,23 +1842,32 @@ with gr.Blocks(
 
 
     # library load
-    def refresh_library():
-        """刷新论文库列表"""
-        df = list_indexed_papers()
-        return df
-
-
-    def on_lib_select(evt: gr.SelectData, df):
-        """当用户在 Library 表格中点击某一行时，记录其论文 ID。"""
+    def refresh_library(page=0, q=""):
+        """刷新论文库列表的第 page 页（q 为标题关键词），返回 (表格, 页码说明, 实际页码, 版本标识, 本页论文 ID)"""
+        version = library_version(q)
+        total = count_indexed_papers(q)
+        n_pages = max(1, -(-total // LIBRARY_PAGE_SIZE))
+        page = min(max(int(page or 0), 0), n_pages - 1)
+        df = list_indexed_papers(LIBRARY_PAGE_SIZE, page * LIBRARY_PAGE_SIZE, q)
+        page_ids = df.iloc[:, _LIB_ID_COL].tolist()
+        return df, f"第 {page + 1} / {n_pages} 页（共 {total} 篇）", page, version, page_ids
+
+
+    def on_lib_select(page_ids, evt: gr.SelectData):
+        """当用户在 Library 表格中点击某一行时，记录其论文 ID（只用事件自带的行数据，不回传整张表）。"""
         try:
-            if df is None or df.empty:
-                return None
+            row_value = getattr(evt, "row_value", None)
+            if row_value:
+                return int(row_value[_LIB_ID_COL])
+            # 旧版 Gradio 没有 row_value：按行号在本会话当前页的论文 ID 中查找
             # evt.index 在 Dataframe 中通常为 (row, col)
             row_idx = evt.index[0] if isinstance(evt.index, (list, tuple)) else evt.index
-            paper_id = int(df.iloc[row_idx]["id"])
-            return paper_id
+            if not page_ids or not 0 <= row_idx < len(page_ids):
+                return None
+            return int(page_ids[row_idx])
         except Exception as e:
-            print(f"[on_lib_select] 解析选中行失败: {e!r}")
+            if DEBUG:
+                print(f"[on_lib_select] 解析选中行失败: {e!r}")
             return None
 
 
@@ -1615,13 +1876,10 @@ with gr.Blocks(
         if paper_id is None:
             return "请先在表格中点击选择一篇论文", "", []
         try:
-            html, json_str = view_paper_metadata(paper_id)
-            try:
-                data = json.loads(json_str) if json_str else {}
-            except Exception:
-                data = {}
-            fig_paths = extract_figure_paths(data)
-            return html, json_str, fig_paths
+            html, json_str, fig_paths = _load_paper_bundle(int(paper_id))
+            return html, json_str, [list(item) for item in fig_paths]
+        except LookupError as e:
+            return str(e), "", []
         except Exception as e:
             return f"读取出错: {e}", "", []
 
@@ -1630,102 +1888,57 @@ with gr.Blocks(
     # The initial value is set during component creation
     # To refresh, use a separate refresh button or load event
     # 1) 表格行选中事件：更新当前选中的论文 ID
-    lib_table.select(fn=on_lib_select, inputs=[lib_table], outputs=[lib_selected_id])
+    #    连续快速点击时只处理最后一次；处理函数很轻，不进入队列、不显示进度
+    lib_table.select(fn=on_lib_select, inputs=[lib_page_ids], outputs=[lib_selected_id],
+                     trigger_mode="always_last", show_progress="hidden", queue=False)
     # 2) 查看按钮：根据选中的 ID 加载论文详情
     lib_view_btn.click(fn=view_selected_paper, inputs=[lib_selected_id],
                        outputs=[lib_details_html, lib_metadata_state, fig_gallery])
+    # 3) 翻页
+    lib_page_outputs = [lib_table, lib_page_md, lib_page, lib_loaded_version, lib_page_ids]
+    lib_prev_btn.click(fn=lambda page, q: refresh_library(page - 1, q), inputs=[lib_page, lib_search],
+                       outputs=lib_page_outputs)
+    lib_next_btn.click(fn=lambda page, q: refresh_library(page + 1, q), inputs=[lib_page, lib_search],
+                       outputs=lib_page_outputs)
+    lib_refresh_btn.click(fn=refresh_library, inputs=[lib_page, lib_search], outputs=lib_page_outputs)
+    # 4) 标题搜索：过滤在 SQL 中完成，结果从第一页开始
+    lib_search.submit(fn=lambda q: refresh_library(0, q), inputs=[lib_search], outputs=lib_page_outputs)
+
+
+    # nav switching：每个视图是一个 Column 容器，切换时只更新三个容器的可见性。
+    # 各选项对应的 (paper_view, sim_view, lib_view) 可见性在构建时确定；
+    # update 字典仍每次新建，因为 Gradio 在后处理时可能修改传入的字典
+    _VIEW_VISIBILITY = {
+        "Paper Analysis": (True, False, False),
+        "Simulation Setup": (False, True, False),
+        "Library": (False, False, True),
+    }
 
-
-    # nav switching (complete visibility control)
-    def switch_view(choice):
-        """切换视图，控制所有相关组件的可见性"""
-        if choice == "Paper Analysis":
-            return (
-                gr.update(visible=True),  # paper_header_html
-                gr.update(visible=True),  # fig_gallery
-                gr.update(visible=True),  # paper_body_html
-                gr.update(visible=False),  # sim_setup_md
-                gr.update(visible=False),  # phenomena_input
-                gr.update(visible=False),  # param_df
-                gr.update(visible=False),  # recom_btn
-                gr.update(visible=False),  # demo_recom_btn
-                gr.update(visible=False),  # add_param_row_btn
-                gr.update(visible=False),  # remove_param_row_btn
-                gr.update(visible=False),  # recom_panel
-                gr.update(visible=False),  # lib_md
-                gr.update(visible=False),  # lib_table
-                gr.update(visible=False),  # lib_view_btn
-                gr.update(visible=False)  # lib_details_html
-            )
-        elif choice == "Simulation Setup":
-            return (
-                gr.update(visible=False),  # paper_header_html
-                gr.update(visible=False),  # fig_gallery
-                gr.update(visible=False),  # paper_body_html
-                gr.update(visible=True),  # sim_setup_md
-                gr.update(visible=True),  # phenomena_input
-                gr.update(visible=True),  # param_df
-                gr.update(visible=True),  # recom_btn
-                gr.update(visible=True),  # demo_recom_btn
-                gr.update(visible=True),  # add_param_row_btn
-                gr.update(visible=True),  # remove_param_row_btn
-                gr.update(visible=True),  # recom_panel
-                gr.update(visible=False),  # lib_md
-                gr.update(visible=False),  # lib_table
-                gr.update(visible=False),  # lib_view_btn
-                gr.update(visible=False)  # lib_details_html
-            )
-        else:  # Library
-            # 每次进入 Library 时刷新表格，确保看得到新入库的论文
-            refreshed_df = refresh_library()
-            return (
-                gr.update(visible=False),  # paper_header_html
-                gr.update(visible=False),  # fig_gallery
-                gr.update(visible=False),  # paper_body_html
-                gr.update(visible=False),  # sim_setup_md
-                gr.update(visible=False),  # phenomena_input
-                gr.update(visible=False),  # param_df
-                gr.update(visible=False),  # recom_btn
-                gr.update(visible=False),  # demo_recom_btn
-                gr.update(visible=False),  # add_param_row_btn
-                gr.update(visible=False),  # remove_param_row_btn
-                gr.update(visible=False),  # recom_panel
-                gr.update(visible=True),  # lib_md
-                gr.update(visible=True, value=refreshed_df),  # lib_table
-                gr.update(visible=True),  # lib_view_btn
-                gr.update(visible=True)  # lib_details_html
-            )
+    def switch_view(choice, lib_query="", loaded_version=None):
+        """切换视图；进入 Library 时若论文库有变化则刷新表格第一页，否则保持已显示的表格与页码"""
+        updates = tuple(gr.update(visible=v) for v in _VIEW_VISIBILITY.get(choice, (False, False, False)))
+        unchanged = tuple(gr.update() for _ in lib_page_outputs)
+        if choice != "Library" or (loaded_version and loaded_version[0] is not None
+                                      and tuple(loaded_version) == library_version(lib_query)):
+            return updates + unchanged
+        # 首次进入或有新论文入库：刷新表格，确保看得到新入库的论文
+        return updates + refresh_library(0, lib_query)
 
 
+    # 切换视图只改可见性（进入 Library 时最多一次分页查询），不经过任务队列
     nav.change(
         fn=switch_view,
-        inputs=[nav],
-        outputs=[
-            paper_header_html,
-            fig_gallery,
-            paper_body_html,
-            sim_setup_md,
-            phenomena_input,
-            param_df,
-            recom_btn,
-            demo_recom_btn,
-            add_param_row_btn,
-            remove_param_row_btn,
-            recom_panel,
-            lib_md,
-            lib_table,
-            lib_view_btn,
-            lib_details_html
-        ]
+        inputs=[nav, lib_search, lib_loaded_version],
+        outputs=[paper_view, sim_view, lib_view] + lib_page_outputs,
+        queue=False,
+        show_progress="hidden",
     )
 
 if __name__ == "__main__":
     os.environ["no_proxy"] = "localhost,127.0.0.1"
 
-    # 显式允许前端通过 file= 协议访问项目根目录及图片目录（解决 404 / 沙箱限制）
+    # 显式允许前端通过 file= 协议访问项目根目录（解决 404 / 沙箱限制）；图片目录已注册为静态路径
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    images_dir = os.path.join(current_dir, "images")
-    figures_dir = os.path.join(current_dir, "figures")
 
     demo.launch(
         theme=gr.themes.Base(
@@ -1733,9 +1946,9 @@ if __name__ == "__main__":
             neutral_hue="slate",
             radius_size="lg"
         ),
-        debug=True,
+        debug=DEBUG,  # 仅在设置 PLASMARAG_DEBUG 时开启
         share=False,
-        allowed_paths=[current_dir, images_dir, figures_dir]
+        allowed_paths=[current_dir]
     )
 
 